@@ -1,63 +1,281 @@
 import json
 import os
 import hashlib
+import hmac
+import contextvars
 import secrets
+import threading
+import time
 import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db_pool import ConnectionPool
+from session_tokens import issue_session_token, verify_session_token
+from runtime import Instrumentation, TimingCursorMixin, compress_response, get_header, is_admin_request, phase
 
-def hash_password(password: str) -> str:
+try:
+    import redis
+except ImportError:
+    redis = None
+
+PASSWORD_HASH_SCHEME = 'pbkdf2_sha256'
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '100000'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '16'))
+LEGACY_PASSWORD_HASH_ITERATIONS = 100000
+
+class PasswordHashingBusy(Exception):
+    pass
+
+class HashingPool:
+    '''Ограниченный пул потоков для PBKDF2: hashlib отпускает GIL на время вычисления'''
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pbkdf2')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'rejected': 0, 'queue_wait_seconds': 0.0, 'run_seconds': 0.0}
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordHashingBusy()
+
+        submitted_at = time.perf_counter()
+        timings = {}
+        # Контекст запроса переносится в поток хэширования вместе с задачей
+        context = contextvars.copy_context()
+
+        def task():
+            started_at = time.perf_counter()
+            timings['wait'] = started_at - submitted_at
+            try:
+                return context.run(fn, *args)
+            finally:
+                timings['run'] = time.perf_counter() - started_at
+
+        def done(_) -> None:
+            with self._lock:
+                self._pending -= 1
+                self._stats['completed'] += 1
+                self._stats['queue_wait_seconds'] += timings.get('wait', 0.0)
+                self._stats['run_seconds'] += timings.get('run', 0.0)
+            self._slots.release()
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._pending += 1
+        future = self._executor.submit(task)
+        future.add_done_callback(done)
+        return future
+
+    def run(self, fn, *args):
+        future = self.submit(fn, *args)
+        with phase('hash'):
+            return future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                'pending': self._pending,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'iterations': PASSWORD_HASH_ITERATIONS
+            }
+
+hashing_pool = HashingPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+def pbkdf2(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations).hex()
+
+def parse_password_hash(stored_password: str) -> tuple:
+    parts = stored_password.split('$')
+    if len(parts) == 4 and parts[0] == PASSWORD_HASH_SCHEME:
+        return int(parts[1]), parts[2], parts[3]
+    if len(parts) == 2:
+        return LEGACY_PASSWORD_HASH_ITERATIONS, parts[0], parts[1]
+    raise ValueError('unknown password hash format')
+
+def compute_password_hash(password: str) -> str:
     salt = secrets.token_hex(16)
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
-    return f"{salt}${pwd_hash.hex()}"
+    pwd_hash = pbkdf2(password, salt, PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_SCHEME}${PASSWORD_HASH_ITERATIONS}${salt}${pwd_hash}"
+
+def check_password(stored_password: str, provided_password: str) -> bool:
+    iterations, salt, pwd_hash = parse_password_hash(stored_password)
+    return hmac.compare_digest(pwd_hash, pbkdf2(provided_password, salt, iterations))
+
+# Синхронные обёртки ждут пул хэширования в потоке обработчика; асинхронный сервер отправляет
+# compute_password_hash и check_password в hashing_pool.submit напрямую
+def hash_password(password: str) -> str:
+    return hashing_pool.run(compute_password_hash, password)
 
 def verify_password(stored_password: str, provided_password: str) -> bool:
-    salt, pwd_hash = stored_password.split('$')
-    check_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt.encode('utf-8'), 100000)
-    return pwd_hash == check_hash.hex()
+    return hashing_pool.run(check_password, stored_password, provided_password)
+
+def password_needs_rehash(stored_password: str) -> bool:
+    return not stored_password.startswith(f'{PASSWORD_HASH_SCHEME}$') or parse_password_hash(stored_password)[0] != PASSWORD_HASH_ITERATIONS
 
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
 
+METRICS_ACTIONS = ('stats', 'metrics', 'slow_queries', 'register', 'login', 'request_reset', 'reset_password', 'verify')
+instrumentation = Instrumentation('auth', METRICS_ACTIONS)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+RATE_LIMITS = {
+    'login': [('ip', 20, 60), ('email', 5, 60)],
+    'request_reset': [('ip', 5, 60), ('email', 3, 3600)]
+}
+
+class TimedCursor(TimingCursorMixin, psycopg2.extensions.cursor):
+    instrumentation = instrumentation
+
+class TimedRealDictCursor(TimingCursorMixin, RealDictCursor):
+    instrumentation = instrumentation
+
+db_pool = ConnectionPool.from_env(cursor_factory=TimedCursor)
+instrumentation.pool = db_pool
+
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    with phase('db_connect'):
+        return db_pool.getconn()
 
-def send_email(to_email: str, subject: str, body: str) -> bool:
-    try:
-        smtp_host = os.environ.get('SMTP_HOST')
-        smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-        smtp_user = os.environ.get('SMTP_USER')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-        
-        if not all([smtp_host, smtp_user, smtp_password]):
-            print("SMTP настройки не заполнены")
-            return False
-        
-        msg = MIMEMultipart('alternative')
-        msg['From'] = smtp_user
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        html_part = MIMEText(body, 'html')
-        msg.attach(html_part)
-        
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-        
-        return True
-    except Exception as e:
-        print(f"Ошибка отправки email: {str(e)}")
-        return False
+def release_db_connection(conn) -> None:
+    db_pool.putconn(conn)
+
+class SlidingWindowLimiter:
+    '''Скользящее окно по двум соседним интервалам; состояние в памяти экземпляра функции'''
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        now = time.time()
+        window_start = now - now % window
+
+        with self._lock:
+            started, current, previous = self._windows.get(key, (window_start, 0, 0))
+            if started < window_start - window:
+                current, previous = 0, 0
+            elif started < window_start:
+                current, previous = 0, current
+
+            estimated = previous * (1 - (now - window_start) / window) + current
+            allowed = estimated < limit
+            if allowed:
+                current += 1
+
+            self._windows[key] = (window_start, current, previous)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+
+        return allowed
+
+class RedisLimiter:
+    '''То же скользящее окно в общем Redis-совместимом хранилище; при его недоступности пропускает запросы'''
+
+    def __init__(self, client, prefix: str = 'auth:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        now = time.time()
+        window_start = int(now - now % window)
+        current_key = f'{self.prefix}{key}:{window_start}'
+
+        try:
+            pipe = self.client.pipeline()
+            pipe.incr(current_key)
+            pipe.expire(current_key, window * 2)
+            pipe.get(f'{self.prefix}{key}:{window_start - window}')
+            current, _, previous = pipe.execute()
+        except Exception as e:
+            print(f"Ошибка ограничителя запросов: {str(e)}")
+            return True
+
+        estimated = int(previous or 0) * (1 - (now - window_start) / window) + current - 1
+        return estimated < limit
+
+def create_rate_limiter():
+    redis_url = os.environ.get('REDIS_URL')
+    if redis_url and redis is not None:
+        return RedisLimiter(redis.Redis.from_url(redis_url))
+    return SlidingWindowLimiter(RATE_LIMIT_MAX_KEYS)
+
+rate_limiter = create_rate_limiter()
+rate_limit_stats = {}
+rate_limit_stats_lock = threading.Lock()
+
+def rate_limit_counters() -> dict:
+    with rate_limit_stats_lock:
+        samples = [
+            ({'rule': rule, 'result': result}, counters[result])
+            for rule, counters in sorted(rate_limit_stats.items())
+            for result in ('allowed', 'rejected')
+        ]
+    return {'rate_limit_checks_total': ('Проверки ограничителя частоты по правилам', samples)}
 
+instrumentation.counters = rate_limit_counters
+
+def get_client_ip(event: dict) -> str:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    forwarded = (get_header(event, 'X-Forwarded-For') or '').split(',')[0].strip()
+    return identity.get('sourceIp') or forwarded or 'unknown'
+
+def check_rate_limits(action: str, body: dict, client_ip: str) -> Optional[dict]:
+    values = {
+        'ip': client_ip,
+        'email': str(body.get('email') or '').strip().lower()
+    }
+
+    for scope, limit, window in RATE_LIMITS.get(action, []):
+        if not values[scope]:
+            continue
+
+        allowed = rate_limiter.hit(f'{action}:{scope}:{window}:{values[scope]}', limit, window)
+        rule = f'{action}:{scope}:{window}'
+        with rate_limit_stats_lock:
+            counters = rate_limit_stats.setdefault(rule, {'allowed': 0, 'rejected': 0})
+            counters['allowed' if allowed else 'rejected'] += 1
+
+        if not allowed:
+            print(json.dumps({'rate_limited': rule, 'ip': client_ip}))
+            return {
+                'statusCode': 429,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': str(window)},
+                'body': json.dumps({'error': 'Слишком много попыток, попробуйте позже'}),
+                'isBase64Encoded': False
+            }
+
+    return None
+
+def smtp_configured() -> bool:
+    return all([os.environ.get('SMTP_HOST'), os.environ.get('SMTP_USER'), os.environ.get('SMTP_PASSWORD')])
+
+def enqueue_email(cur, to_email: str, subject: str, body: str) -> None:
+    cur.execute("""
+        INSERT INTO t_p2283616_event_discovery_app.email_outbox (to_email, subject, body)
+        VALUES (%s, %s, %s)
+    """, (to_email, subject, body))
+
+@instrumentation.instrumented
 def handler(event: dict, context) -> dict:
     '''API для регистрации и авторизации пользователей через email и пароль'''
+    return compress_response(event, route_request(event))
+
+def route_request(event: dict) -> dict:
     method = event.get('httpMethod', 'POST')
     
     if method == 'OPTIONS':
@@ -72,11 +290,26 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
+    if (event.get('queryStringParameters') or {}).get('action') == 'metrics':
+        instrumentation.label_request('metrics')
+        return instrumentation.metrics_response(event)
+    
     try:
         body = json.loads(event.get('body', '{}'))
         action = body.get('action')
-        
-        if action == 'register':
+        instrumentation.label_request(action)
+        
+        limited = check_rate_limits(action, body, get_client_ip(event))
+        if limited:
+            return limited
+        
+        if action == 'stats':
+            return get_stats(event)
+        elif action == 'metrics':
+            return instrumentation.metrics_response(event)
+        elif action == 'slow_queries':
+            return instrumentation.slow_queries_response(event)
+        elif action == 'register':
             return register_user(body)
         elif action == 'login':
             return login_user(body)
@@ -94,6 +327,13 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
     
+    except PasswordHashingBusy:
+        return {
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': '1'},
+            'body': json.dumps({'error': 'Сервер перегружен, попробуйте позже'}),
+            'isBase64Encoded': False
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -137,7 +377,7 @@ def send_sms_code(body: dict) -> dict:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def verify_sms_code(body: dict) -> dict:
     phone = body.get('phone')
@@ -152,7 +392,7 @@ def verify_sms_code(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("""
@@ -197,13 +437,12 @@ def verify_sms_code(body: dict) -> dict:
                 RETURNING id, phone, full_name, created_at
             """, (phone, phone))
             user = cur.fetchone()
-            conn.commit()
         
         cur.execute("DELETE FROM sms_codes WHERE phone = %s", (phone,))
+        # Токен выдаётся до фиксации: если подписать его не удалось, пользователь и код не сохраняются
+        token = issue_session_token(user)
         conn.commit()
         
-        token = generate_token()
-        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -222,7 +461,7 @@ def verify_sms_code(body: dict) -> dict:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def register_user(body: dict) -> dict:
     email = body.get('email')
@@ -247,7 +486,7 @@ def register_user(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("SELECT id FROM t_p2283616_event_discovery_app.users WHERE email = %s", (email,))
@@ -269,10 +508,9 @@ def register_user(body: dict) -> dict:
         """, (phone, email, password_hash, full_name))
         
         user = cur.fetchone()
+        token = issue_session_token(user)
         conn.commit()
         
-        token = generate_token()
-        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -291,7 +529,7 @@ def register_user(body: dict) -> dict:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def login_user(body: dict) -> dict:
     email = body.get('email')
@@ -306,7 +544,7 @@ def login_user(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("""
@@ -317,42 +555,51 @@ def login_user(body: dict) -> dict:
         user = cur.fetchone()
         
         if not user:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неверный email или пароль'}),
-                'isBase64Encoded': False
-            }
+            return invalid_credentials_response()
         
         if not user['password_hash'] or not verify_password(user['password_hash'], password):
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неверный email или пароль'}),
-                'isBase64Encoded': False
-            }
+            return invalid_credentials_response()
         
-        token = generate_token()
+        if password_needs_rehash(user['password_hash']):
+            cur.execute("""
+                UPDATE t_p2283616_event_discovery_app.users 
+                SET password_hash = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (hash_password(password), user['id']))
+            conn.commit()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'message': 'Вход выполнен',
-                'token': token,
-                'user': {
-                    'id': user['id'],
-                    'email': user['email'],
-                    'full_name': user['full_name'],
-                    'created_at': user['created_at'].isoformat() if user['created_at'] else None
-                }
-            }),
-            'isBase64Encoded': False
-        }
+        return login_response(user)
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+
+def invalid_credentials_response() -> dict:
+    return {
+        'statusCode': 401,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Неверный email или пароль'}),
+        'isBase64Encoded': False
+    }
+
+def login_response(user: dict) -> dict:
+    token = issue_session_token(user)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'message': 'Вход выполнен',
+            'token': token,
+            'user': {
+                'id': user['id'],
+                'email': user['email'],
+                'full_name': user['full_name'],
+                'created_at': user['created_at'].isoformat() if user['created_at'] else None
+            }
+        }),
+        'isBase64Encoded': False
+    }
 
 def request_password_reset(body: dict) -> dict:
     email = body.get('email')
@@ -366,7 +613,7 @@ def request_password_reset(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("SELECT id FROM t_p2283616_event_discovery_app.users WHERE email = %s", (email,))
@@ -387,7 +634,6 @@ def request_password_reset(body: dict) -> dict:
             INSERT INTO t_p2283616_event_discovery_app.password_reset_tokens (user_id, token, expires_at)
             VALUES (%s, %s, %s)
         """, (user['id'], reset_token, expires_at))
-        conn.commit()
         
         email_subject = "Восстановление пароля - Польза"
         email_body = f"""
@@ -407,26 +653,28 @@ def request_password_reset(body: dict) -> dict:
         </html>
         """
         
-        email_sent = send_email(email, email_subject, email_body)
+        email_queued = smtp_configured()
         
-        if email_sent:
-            print(f"Email отправлен на {email}")
+        if email_queued:
+            enqueue_email(cur, email, email_subject, email_body)
         else:
-            print(f"Ошибка отправки email. Токен для теста: {reset_token}")
+            print(f"SMTP настройки не заполнены. Токен для теста: {reset_token}")
+        
+        conn.commit()
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'message': 'Ссылка для восстановления отправлена на email',
-                'reset_token': reset_token if not email_sent else None
+                'reset_token': reset_token if not email_queued else None
             }),
             'isBase64Encoded': False
         }
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def reset_password(body: dict) -> dict:
     token = body.get('token')
@@ -449,7 +697,7 @@ def reset_password(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("""
@@ -500,10 +748,10 @@ def reset_password(body: dict) -> dict:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def verify_token(event: dict) -> dict:
-    token = event.get('headers', {}).get('X-Auth-Token')
+    token = get_header(event, 'X-Auth-Token')
     
     if not token:
         return {
@@ -513,9 +761,44 @@ def verify_token(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
+    claims = verify_session_token(token)
+    
+    if claims is None:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'valid': True,
+            'message': 'Токен действителен',
+            'user_id': claims['sub'],
+            'expires_at': claims['exp']
+        }),
+        'isBase64Encoded': False
+    }
+
+def get_stats(event: dict) -> dict:
+    if not is_admin_request(event):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'valid': True, 'message': 'Токен действителен'}),
+        'body': json.dumps({
+            'db_pool': db_pool.stats(),
+            'password_hashing': hashing_pool.stats(),
+            'rate_limits': dict(rate_limit_stats)
+        }),
         'isBase64Encoded': False
     }
\ No newline at end of file
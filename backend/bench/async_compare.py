@@ -0,0 +1,145 @@
+'''Сравнение асинхронного пути asyncpg с синхронным пулом потоков в ASGI-обёртке backend/server
+
+Оба прогона идут в одном процессе и одном цикле событий: сотни корутин-клиентов вызывают приложение напрямую,
+без сокетов, так что разница в задержках — это разница путей доступа к базе.
+
+Пример: python backend/bench/async_compare.py --concurrency 400 --threads 16 --duration 30 --output async.json
+'''
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from common import BACKEND_DIR, apply_env, summarize
+from run import SCENARIOS, Dataset, parse_mix, print_table
+
+# Только действия, у которых есть асинхронная реализация в backend/server/async_db.py
+ASYNC_SCENARIOS = ('list_events', 'check_payment', 'get_user_registrations', 'login')
+DEFAULT_MIX = {'list_events': 60, 'check_payment': 20, 'get_user_registrations': 15, 'login': 5}
+
+def load_server():
+    server_dir = os.path.join(BACKEND_DIR, 'server')
+    sys.path.insert(0, server_dir)
+    spec = importlib.util.spec_from_file_location('bench_server_app', os.path.join(server_dir, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+async def asgi_call(app, function: str, event: dict) -> int:
+    body = (event.get('body') or '').encode('utf-8')
+    source_ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp') or '127.0.0.1'
+    scope = {
+        'type': 'http',
+        'method': event['httpMethod'],
+        'path': f'/{function}',
+        'query_string': urlencode(event.get('queryStringParameters') or {}).encode('latin-1'),
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in event['headers'].items()],
+        'client': (source_ip, 0)
+    }
+    status = [None]
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+
+    await app.http(scope, receive, send)
+    return status[0]
+
+async def run_mode(server, use_async: bool, data: Dataset, mix: dict, concurrency: int, duration: float, seed: int) -> dict:
+    server.SERVER_ASYNC_DB = use_async
+    app = server.FunctionApp()
+    await app.startup()
+    if use_async and app.async_db is None:
+        await app.shutdown()
+        raise SystemExit('Асинхронный путь не поднялся: нужен asyncpg и DATABASE_URL')
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    errors = defaultdict(int)
+    deadline = time.monotonic() + duration
+
+    async def client(client_id: int) -> None:
+        rng = random.Random(seed + client_id)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            function, event = SCENARIOS[name](data, rng)
+            started = time.perf_counter()
+            try:
+                status = await asgi_call(app, function, event)
+            except Exception:
+                status = None
+            latencies[name].append(time.perf_counter() - started)
+            if status is None or status >= 500:
+                errors[name] += 1
+            statuses[name][status or 0] += 1
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+    finally:
+        wall = time.monotonic() - started
+        await app.shutdown()
+
+    results = {name: summarize(latencies[name], statuses[name], errors[name], wall) for name in latencies}
+    all_statuses = defaultdict(int)
+    for per_status in statuses.values():
+        for code, count in per_status.items():
+            all_statuses[code] += count
+    results['_all'] = summarize([value for values in latencies.values() for value in values],
+                                all_statuses, sum(errors.values()), wall)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Асинхронный путь к базе против пула потоков')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--scenario', help='Смесь вида list_events:60,login:5; по умолчанию только асинхронные действия')
+    parser.add_argument('--concurrency', type=int, default=400, help='Одновременных клиентов-корутин')
+    parser.add_argument('--threads', type=int, default=16, help='Потоков синхронного пути (SERVER_THREADS)')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE до загрузки функций')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SERVER_THREADS', str(args.threads))
+    # Сравнение идёт в одном процессе: весь бюджет соединений DB_CONNECTION_BUDGET достаётся ему
+    os.environ.setdefault('SERVER_WORKERS', '1')
+    overrides = apply_env(args.env)
+    if args.dsn:
+        os.environ['DATABASE_URL'] = args.dsn
+    mix = parse_mix(args.scenario) if args.scenario else DEFAULT_MIX
+    unsupported = [name for name in mix if name not in ASYNC_SCENARIOS]
+    if unsupported:
+        parser.error(f'Нет асинхронной реализации: {", ".join(unsupported)}')
+
+    server = load_server()
+    data = Dataset(args.dsn)
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'concurrency': args.concurrency,
+        'threads': server.SERVER_THREADS,
+        'async_pool_max_size': server.SERVER_ASYNC_POOL_MAX_SIZE,
+        'duration_s': args.duration,
+        'env': overrides,
+        'modes': {}
+    }
+    for mode, use_async in (('sync', False), ('async', True)):
+        report['modes'][mode] = asyncio.run(run_mode(server, use_async, data, mix, args.concurrency, args.duration, args.seed))
+        print(f'\n{mode}:')
+        print_table(report['modes'][mode])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
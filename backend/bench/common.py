@@ -0,0 +1,120 @@
+'''Общие помощники бенчмарков: загрузка функций из backend/ и подсчёт перцентилей'''
+import importlib.util
+import math
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ('events', 'payment', 'auth')
+SCHEMA = 't_p2283616_event_discovery_app'
+BENCH_PASSWORD = 'bench-password'
+
+_loaded = {}
+
+def apply_env(pairs: list, concurrency: int = 0) -> dict:
+    # Настройки функций читаются при импорте, поэтому окружение задаётся до загрузки модулей
+    overrides = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        overrides[key] = value
+        os.environ[key] = value
+    os.environ.setdefault('REQUEST_LOG', '0')
+    # Функции без AUTH_TOKEN_KEYS не выдают токенов; стенду нужен свой явный ключ, если он не передан через --env
+    os.environ.setdefault('AUTH_TOKEN_KEYS', 'bench:bench-token-secret')
+    # В облаке экземпляр обслуживает один запрос, здесь же все потоки делят один пул
+    if concurrency:
+        os.environ.setdefault('DB_POOL_MAX_SIZE', str(concurrency))
+    return overrides
+
+def serve_latency_proxy(target: tuple, delay: float, ready) -> None:
+    def forward(source: socket.socket, destination: socket.socket) -> None:
+        # Каждый кусок уходит через delay после прихода, без очереди за предыдущими: задержка, а не полоса.
+        # time.sleep точнее таймеров asyncio, которые округляют ожидание до миллисекунды
+        chunks = queue.Queue()
+
+        def deliver() -> None:
+            while True:
+                arrived, data = chunks.get()
+                if not data:
+                    break
+                time.sleep(max(arrived + delay - time.monotonic(), 0))
+                destination.sendall(data)
+            destination.shutdown(socket.SHUT_WR)
+
+        threading.Thread(target=deliver, daemon=True).start()
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b''
+            chunks.put((time.monotonic(), data))
+            if not data:
+                break
+
+    listener = socket.create_server(('127.0.0.1', 0))
+    ready.send(listener.getsockname()[1])
+    while True:
+        client, _ = listener.accept()
+        server = socket.create_connection(target)
+        for conn in (client, server):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=forward, args=(client, server), daemon=True).start()
+        threading.Thread(target=forward, args=(server, client), daemon=True).start()
+
+def start_latency_proxy(dsn: str, rtt_ms: float) -> str:
+    '''TCP-прокси к базе с задержкой rtt_ms/2 в каждую сторону; возвращает строку подключения через прокси
+
+    Локальная база отвечает за десятки микросекунд, а функции в облаке ходят к ней по сети: без задержки
+    число обращений к базе на запрос в замерах почти ничего не стоит. Прокси живёт в отдельном процессе,
+    иначе он ждал бы GIL вместе с потоками нагрузки и задержка росла бы вместе с ней.
+    '''
+    parts = urlsplit(dsn)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    multiprocessing.Process(target=serve_latency_proxy, args=((parts.hostname or 'localhost', parts.port or 5432), rtt_ms / 2000, sender),
+                            name='latency-proxy', daemon=True).start()
+    port = receiver.recv()
+    credentials = parts.netloc.rpartition('@')[0]
+    return urlunsplit(parts._replace(netloc=f'{credentials}@127.0.0.1:{port}' if credentials else f'127.0.0.1:{port}'))
+
+def load_function(name: str):
+    if name not in _loaded:
+        path = os.path.join(BACKEND_DIR, name, 'index.py')
+        # Копии общих модулей (db_pool.py и др.) лежат рядом с index.py и одинаковы во всех функциях
+        if os.path.dirname(path) not in sys.path:
+            sys.path.append(os.path.dirname(path))
+        spec = importlib.util.spec_from_file_location(f'bench_{name}', path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        _loaded[name] = module
+    return _loaded[name]
+
+def load_shared(name: str):
+    # Общие модули (runtime, session_tokens) импортируются из папки любой загруженной функции
+    load_function('events')
+    return importlib.import_module(name)
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+def summarize(latencies: list, statuses: dict, errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': errors
+    }
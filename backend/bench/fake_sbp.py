@@ -0,0 +1,39 @@
+'''Локальная имитация СБП для стенда: подписывает уведомление об оплате и отправляет его в payment_webhook
+
+Пример: python backend/bench/fake_sbp.py http://localhost:8000/payment <payment_id> --status paid
+'''
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import urllib.error
+import urllib.request
+
+def sign_notification(raw_body: str, secret: str) -> str:
+    return hmac.new(secret.encode('utf-8'), raw_body.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def build_notification(payment_id: str, status: str, secret: str) -> tuple:
+    raw_body = json.dumps({'action': 'payment_webhook', 'payment_id': payment_id, 'status': status})
+    return raw_body, {'Content-Type': 'application/json', 'X-Signature': sign_notification(raw_body, secret)}
+
+def send_notification(url: str, payment_id: str, status: str, secret: str) -> tuple:
+    raw_body, headers = build_notification(payment_id, status, secret)
+    request = urllib.request.Request(url, data=raw_body.encode('utf-8'), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Отправить подписанное уведомление СБП')
+    parser.add_argument('url')
+    parser.add_argument('payment_id')
+    parser.add_argument('--status', default='paid')
+    parser.add_argument('--secret', default=os.environ.get('SBP_WEBHOOK_SECRET', ''))
+    parser.add_argument('--repeat', type=int, default=1, help='Повторить доставку для проверки идемпотентности')
+    args = parser.parse_args()
+    for _ in range(args.repeat):
+        status, body = send_notification(args.url, args.payment_id, args.status, args.secret)
+        print(status, body)
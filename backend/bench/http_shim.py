@@ -0,0 +1,67 @@
+'''Локальный HTTP-сервер, который превращает запросы в event облачной функции и вызывает handler'''
+import argparse
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from common import FUNCTIONS, apply_env, load_function
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    handlers = {}
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        name = url.path.strip('/').split('/', 1)[0]
+        handler = self.handlers.get(name)
+        if handler is None:
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        response = handler({
+            'httpMethod': self.command,
+            'headers': dict(self.headers.items()),
+            'queryStringParameters': dict(parse_qsl(url.query)) or None,
+            'body': body,
+            'isBase64Encoded': False,
+            'requestContext': {'identity': {'sourceIp': self.client_address[0]}}
+        }, None)
+
+        payload = response.get('body') or ''
+        payload = base64.b64decode(payload) if response.get('isBase64Encoded') else payload.encode('utf-8')
+        self.send_response(response['statusCode'])
+        for key, value in (response.get('headers') or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_OPTIONS = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    FunctionRequestHandler.handlers = {name: load_function(name).handler for name in FUNCTIONS}
+    server = ThreadingHTTPServer((host, port), FunctionRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP-обёртка над handler функций events, payment и auth')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE до загрузки функций')
+    parser.add_argument('--pool-size', type=int, default=32)
+    args = parser.parse_args()
+    apply_env(args.env, args.pool_size)
+    server = start_server(args.host, args.port)
+    print(f'Слушаю http://{args.host}:{server.server_address[1]}/{{events,payment,auth}}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,194 @@
+'''Микробенчмарки без базы: сериализация строк ленты, сжатие ответа и стоимость PBKDF2 по числу итераций
+
+Пример: python backend/bench/micro.py --rows 10000,100000 --output micro.json
+'''
+import argparse
+import base64
+import gzip
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+from common import apply_env, load_function, load_shared
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+SAMPLE_WORDS = (
+    'джаз', 'рок', 'лекция', 'история', 'йога', 'марафон', 'выставка', 'кино', 'стендап', 'театр', 'вечер', 'встреча',
+    'город', 'музыка', 'мастер', 'класс', 'для', 'всех', 'начинающих', 'опытных', 'площадка', 'центр', 'вход', 'свободный'
+)
+SAMPLE_CATEGORIES = ('concert', 'lecture', 'masterclass', 'party', 'sport', 'exhibition')
+SAMPLE_CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Сочи')
+
+def sample_rows(count: int, seed: int = 1) -> list:
+    # Кортежи в том виде, в каком их отдаёт курсор ленты: поля EVENT_FIELDS и ключ сортировки.
+    # Тексты и координаты различаются от строки к строке, иначе gzip сжимает страницу в десятки раз лучше настоящей
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        event_date = date(2027, 1, 1 + rng.randrange(28))
+        rows.append((
+            100000 + rng.randrange(900000),
+            ' '.join(rng.choice(SAMPLE_WORDS) for _ in range(3)).capitalize() + f' №{i}',
+            ' '.join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randrange(10, 40))).capitalize() + '.',
+            rng.choice(SAMPLE_CATEGORIES), rng.choice(SAMPLE_CITIES),
+            event_date, dt_time(10 + rng.randrange(12), rng.randrange(4) * 15), rng.randrange(10) * 100,
+            Decimal(f'{rng.uniform(43, 60):.8f}'), Decimal(f'{rng.uniform(20, 83):.8f}'),
+            rng.choice((None, 20 + rng.randrange(480))), 'published', f'Участник {rng.randrange(100000)}',
+            datetime(2026, 10, 1 + rng.randrange(16), rng.randrange(24), rng.randrange(60), rng.randrange(60)),
+            event_date
+        ))
+    return rows
+
+def legacy_page_body(rows: list) -> str:
+    # Сериализация ленты до общего dumps(): словарь с str()/float() на каждую строку и json.dumps
+    events = []
+    for row in rows:
+        events.append({
+            'id': row[0],
+            'title': row[1],
+            'description': row[2],
+            'category': row[3],
+            'city': row[4],
+            'date': str(row[5]),
+            'time': str(row[6]),
+            'participant_price': row[7],
+            'latitude': float(row[8]) if row[8] else None,
+            'longitude': float(row[9]) if row[9] else None,
+            'max_participants': row[10],
+            'status': row[11],
+            'organizer_name': row[12],
+            'created_at': row[13].isoformat()
+        })
+    return json.dumps({'events': events})
+
+def template_page_body(runtime, rows: list, fields: tuple) -> str:
+    # Кортеж без промежуточного словаря: шаблон объекта с готовыми ключами, значения кодируются по одному
+    template = '{' + ','.join(f'"{name}":%s' for name in fields) + '}'
+    encode = runtime.dumps
+    return '{"events":[' + ','.join(template % tuple(encode(value) for value in row[:len(fields)]) for row in rows) + '],"next_cursor":null}'
+
+def bench_serialization(row_counts: list, repeat: int) -> dict:
+    events = load_function('events')
+    runtime = load_shared('runtime')
+    results = {'orjson': runtime.orjson is not None}
+    for count in row_counts:
+        rows = sample_rows(count)
+        results[str(count)] = {
+            'legacy_ms': round(best_of(repeat, lambda: legacy_page_body(rows)) * 1000, 2),
+            'page_body_ms': round(best_of(repeat, lambda: events.events_page_body(rows, False, False)) * 1000, 2),
+            'template_ms': round(best_of(repeat, lambda: template_page_body(runtime, rows, events.EVENT_FIELDS)) * 1000, 2),
+            'legacy_bytes': len(legacy_page_body(rows).encode('utf-8')),
+            'bytes': len(events.events_page_body(rows, False, False).encode('utf-8'))
+        }
+    return results
+
+def bench_compression(page_sizes: list, repeat: int, gzip_levels: list) -> dict:
+    events = load_function('events')
+    runtime = load_shared('runtime')
+    results = {'brotli': runtime.brotli is not None, 'gzip_level': runtime.RESPONSE_GZIP_LEVEL}
+    for page_size in page_sizes:
+        body = events.events_page_body(sample_rows(page_size), False, False)
+        raw = body.encode('utf-8')
+        results[str(page_size)] = per_encoding = {'raw_bytes': len(raw)}
+        # Цена каждого уровня gzip на той же странице: сколько процессора стоит каждый сэкономленный килобайт
+        per_encoding['gzip_levels'] = {
+            str(level): {
+                'ms': round(best_of(repeat, lambda: gzip.compress(raw, compresslevel=level, mtime=0)) * 1000, 3),
+                'bytes': len(gzip.compress(raw, compresslevel=level, mtime=0))
+            } for level in gzip_levels
+        }
+        for encoding in ('gzip', 'br'):
+            if encoding == 'br' and runtime.brotli is None:
+                continue
+            event = {'headers': {'Accept-Encoding': encoding}}
+            response = {'statusCode': 200, 'headers': {}, 'body': body, 'isBase64Encoded': False}
+            compressed = runtime.compress_response(event, response)
+            per_encoding[encoding] = {
+                'ms': round(best_of(repeat, lambda: runtime.compress_response(event, response)) * 1000, 3),
+                'bytes': len(base64.b64decode(compressed['body'])) if compressed.get('isBase64Encoded') else None
+            }
+    return results
+
+def bench_password_hashing(concurrency: int, logins: int) -> dict:
+    auth = load_function('auth')
+    stored = auth.hash_password('bench-password')
+    single = best_of(3, lambda: auth.verify_password(stored, 'bench-password'))
+
+    rejected = 0
+    def verify(_):
+        nonlocal rejected
+        try:
+            auth.verify_password(stored, 'bench-password')
+        except auth.PasswordHashingBusy:
+            rejected += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(verify, range(logins)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'iterations': auth.PASSWORD_HASH_ITERATIONS,
+        'workers': auth.PASSWORD_HASH_WORKERS,
+        'verify_ms': round(single * 1000, 2),
+        'concurrency': concurrency,
+        'verifications_per_s': round((logins - rejected) / elapsed, 1),
+        'rejected': rejected
+    }
+
+def bench_pbkdf2_iterations(iteration_counts: list, repeat: int) -> list:
+    # Один вход — одна проверка PBKDF2 на одном ядре, поэтому входов в секунду на ядро — это 1 / время проверки
+    auth = load_function('auth')
+    table = []
+    for iterations in iteration_counts:
+        verify_s = best_of(repeat, lambda: auth.pbkdf2('bench-password', 'bench-salt', iterations))
+        table.append({
+            'iterations': iterations,
+            'verify_ms': round(verify_s * 1000, 2),
+            'logins_per_s_per_core': round(1 / verify_s, 1),
+            'logins_per_s_per_instance': round(auth.PASSWORD_HASH_WORKERS / verify_s, 1)
+        })
+    return table
+
+def print_pbkdf2_table(table: list) -> None:
+    print(f'{"итераций":>10} {"проверка, мс":>13} {"входов/с на ядро":>17} {"входов/с на экземпляр":>22}')
+    for row in table:
+        print(f'{row["iterations"]:>10} {row["verify_ms"]:>13} {row["logins_per_s_per_core"]:>17} {row["logins_per_s_per_instance"]:>22}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Микробенчмарки без базы данных')
+    parser.add_argument('--rows', default='10000,100000', help='Размеры выборки для сериализации')
+    parser.add_argument('--pages', default='20,50,200', help='Размеры страницы для сжатия')
+    parser.add_argument('--gzip-levels', default='1,6,9', help='Уровни gzip для сравнения процессора и байтов')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--iterations', default='100000,210000,310000,600000', help='Число итераций PBKDF2 для таблицы входов в секунду')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE до загрузки функций')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    overrides = apply_env(args.env)
+    report = {
+        'env': overrides,
+        'serialization': bench_serialization([int(n) for n in args.rows.split(',')], args.repeat),
+        'compression': bench_compression([int(n) for n in args.pages.split(',')], args.repeat,
+                                         [int(n) for n in args.gzip_levels.split(',')]),
+        'password_hashing': bench_password_hashing(args.concurrency, args.logins),
+        'pbkdf2_iterations': bench_pbkdf2_iterations([int(n) for n in args.iterations.split(',')], args.repeat)
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print_pbkdf2_table(report['pbkdf2_iterations'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
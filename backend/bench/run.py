@@ -0,0 +1,825 @@
+'''Нагрузочный прогон handler функций events, payment и auth в процессе или через HTTP-обёртку
+
+Примеры:
+    python backend/bench/run.py load --concurrency 16 --duration 30 --output run.json
+    python backend/bench/run.py load --scenario list_events --env LISTING_SQL_JSON=1 --baseline run.json
+    python backend/bench/run.py load --mode http --scenario login,create_payment
+    python backend/bench/run.py explain
+    python backend/bench/run.py explain --compare-v0010 --output explain.json
+    python backend/bench/run.py parity
+    python backend/bench/run.py oversell --seats 50 --buyers 500
+    python backend/bench/run.py oversell --seats 50 --buyers 500 --late-payments 20
+    python backend/bench/run.py --db-rtt-ms 1 load --scenario create_payment
+    python backend/bench/run.py outbox --emails 2000
+    python backend/bench/run.py --db-rtt-ms 1 bulk --sizes 100,1000
+'''
+import argparse
+import difflib
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import psycopg2
+
+from common import BACKEND_DIR, BENCH_PASSWORD, SCHEMA, apply_env, load_function, load_shared, start_latency_proxy, summarize
+from seed import CATEGORIES, CITIES, WORDS
+
+class Dataset:
+    '''Границы идентификаторов в наполненной базе, из которых сценарии выбирают случайные записи'''
+
+    def __init__(self, dsn: str):
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT (SELECT COALESCE(MAX(id), 0) FROM {SCHEMA}.users),
+                           (SELECT COALESCE(MAX(id), 0) FROM {SCHEMA}.events),
+                           (SELECT COALESCE(MAX(id), 0) FROM {SCHEMA}.registrations)
+                """)
+                self.users, self.events, self.registrations = cur.fetchone()
+        finally:
+            conn.close()
+        if not self.users or not self.events:
+            raise SystemExit('База пуста: сначала запустите seed.py')
+
+def post(body: dict) -> dict:
+    return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+
+def get(params: dict) -> dict:
+    return {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': params}
+
+def scenario_list_events(data: Dataset, rng: random.Random) -> tuple:
+    city, lat, lon = rng.choice(CITIES)
+    variant = rng.randrange(6)
+    if variant == 0:
+        params = {}
+    elif variant == 1:
+        params = {'city': city}
+    elif variant == 2:
+        params = {'city': city, 'category': rng.choice(CATEGORIES)}
+    elif variant == 3:
+        params = {'q': rng.choice(WORDS)}
+    elif variant == 4:
+        params = {'lat': str(lat), 'lon': str(lon), 'radius_km': '10'}
+    else:
+        params = {'bbox': f'{lon - 0.2},{lat - 0.1},{lon + 0.2},{lat + 0.1}'}
+    return 'events', get(params)
+
+def scenario_check_payment(data: Dataset, rng: random.Random) -> tuple:
+    return 'payment', post({'action': 'check_payment', 'registration_id': rng.randint(1, data.registrations)})
+
+def scenario_get_user_registrations(data: Dataset, rng: random.Random) -> tuple:
+    return 'payment', post({'action': 'get_user_registrations', 'user_id': rng.randint(1, data.users)})
+
+def scenario_create_payment(data: Dataset, rng: random.Random) -> tuple:
+    return 'payment', post({
+        'action': 'create_payment',
+        'user_id': rng.randint(1, data.users),
+        'event_id': rng.randint(1, data.events),
+        'event_title': 'Нагрузочный тест',
+        'event_price': 100
+    })
+
+def scenario_login(data: Dataset, rng: random.Random) -> tuple:
+    event = post({'action': 'login', 'email': f'bench{rng.randint(1, data.users)}@example.com', 'password': BENCH_PASSWORD})
+    # Разные адреса клиентов, чтобы ограничитель частоты не превращал прогон в замер ответов 429
+    event['requestContext'] = {'identity': {'sourceIp': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}'}}
+    return 'auth', event
+
+def scenario_organizer_stats(data: Dataset, rng: random.Random) -> tuple:
+    # Сводка отдаётся только по токену организатора; ключ подписи тот же, что у функций (AUTH_TOKEN_KEYS из --env или ключ стенда)
+    event = post({'action': 'organizer_stats'})
+    event['headers']['X-Auth-Token'] = load_shared('session_tokens').issue_session_token({'id': rng.randint(1, data.users)})
+    return 'events', event
+
+def scenario_create_events_bulk(data: Dataset, rng: random.Random) -> tuple:
+    city, _, _ = rng.choice(CITIES)
+    events = [{
+        'title': f'Импорт {i}',
+        'category': rng.choice(CATEGORIES),
+        'city': city,
+        'event_date': '2027-01-15',
+        'event_time': '19:00',
+        'participant_price': 500,
+        'max_participants': 100
+    } for i in range(BULK_SIZE)]
+    return 'events', post({'action': 'create_events_bulk', 'organizer_id': rng.randint(1, data.users), 'events': events})
+
+BULK_SIZE = 10000
+SCENARIOS = {
+    'list_events': scenario_list_events,
+    'check_payment': scenario_check_payment,
+    'get_user_registrations': scenario_get_user_registrations,
+    'create_payment': scenario_create_payment,
+    'login': scenario_login,
+    'organizer_stats': scenario_organizer_stats,
+    'create_events_bulk': scenario_create_events_bulk
+}
+# Смесь по умолчанию повторяет реальный трафик: в основном чтение ленты и статусов оплаты
+DEFAULT_MIX = {
+    'list_events': 60,
+    'check_payment': 15,
+    'get_user_registrations': 10,
+    'create_payment': 8,
+    'login': 5,
+    'organizer_stats': 2
+}
+
+class InProcessClient:
+    def __init__(self):
+        self.handlers = {}
+
+    def call(self, function: str, event: dict) -> int:
+        if function not in self.handlers:
+            self.handlers[function] = load_function(function).handler
+        return self.handlers[function](event, None)['statusCode']
+
+class HttpClient:
+    '''Отдельное keep-alive соединение на поток'''
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.local = threading.local()
+
+    def call(self, function: str, event: dict) -> int:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        path = f'/{function}'
+        if event.get('queryStringParameters'):
+            path += '?' + urlencode(event['queryStringParameters'])
+        headers = dict(event.get('headers') or {})
+        identity = (event.get('requestContext') or {}).get('identity') or {}
+        if identity.get('sourceIp'):
+            headers['X-Forwarded-For'] = identity['sourceIp']
+        try:
+            conn.request(event['httpMethod'], path, body=event.get('body'), headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+
+def parse_mix(value: str) -> dict:
+    if not value:
+        return DEFAULT_MIX
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition(':')
+        if name not in SCENARIOS:
+            raise SystemExit(f'Неизвестный сценарий {name}; доступны: {", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+def run_load(client, data: Dataset, mix: dict, concurrency: int, duration: float, max_requests: int, seed: int) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.monotonic() + duration
+
+    def worker(worker_id: int) -> None:
+        rng = random.Random(seed + worker_id)
+        while time.monotonic() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            name = rng.choices(names, weights)[0]
+            function, event = SCENARIOS[name](data, rng)
+            started = time.perf_counter()
+            try:
+                status = client.call(function, event)
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[name].append(elapsed)
+                if status is None or status >= 500:
+                    errors[name] += 1
+                statuses[name][status or 0] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+    wall = time.monotonic() - started
+
+    results = {name: summarize(latencies[name], statuses[name], errors[name], wall) for name in latencies}
+    all_latencies = [value for values in latencies.values() for value in values]
+    all_statuses = defaultdict(int)
+    for per_status in statuses.values():
+        for code, count in per_status.items():
+            all_statuses[code] += count
+    results['_all'] = summarize(all_latencies, all_statuses, sum(errors.values()), wall)
+    return results
+
+def compare(current: dict, baseline: dict, threshold_pct: float) -> list:
+    # Регрессия: p95 вырос или пропускная способность упала больше порога
+    regressions = []
+    for name, stats in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or not base.get('requests'):
+            continue
+        p95_delta = (stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+        rps_delta = (stats['rps'] - base['rps']) / base['rps'] * 100 if base['rps'] else 0.0
+        stats['baseline'] = {'p95_ms': base['p95_ms'], 'rps': base['rps'],
+                             'p95_delta_pct': round(p95_delta, 1), 'rps_delta_pct': round(rps_delta, 1)}
+        if p95_delta > threshold_pct or rps_delta < -threshold_pct:
+            regressions.append(name)
+    return regressions
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def print_table(scenarios: dict) -> None:
+    print(f'{"сценарий":<24}{"запросов":>10}{"rps":>10}{"p50 мс":>10}{"p95 мс":>10}{"p99 мс":>10}{"ошибок":>8}  база p95/rps')
+    for name, stats in scenarios.items():
+        base = stats.get('baseline')
+        delta = f'  {base["p95_delta_pct"]:+.1f}% / {base["rps_delta_pct"]:+.1f}%' if base else ''
+        print(f'{name:<24}{stats["requests"]:>10}{stats["rps"]:>10}{stats["p50_ms"]:>10}'
+              f'{stats["p95_ms"]:>10}{stats["p99_ms"]:>10}{stats["errors"]:>8}{delta}')
+
+def command_load(args) -> int:
+    global BULK_SIZE
+    BULK_SIZE = args.bulk_size
+    overrides = apply_env(args.env, args.concurrency)
+    data = Dataset(args.dsn)
+    mix = parse_mix(args.scenario)
+
+    server = None
+    if args.mode == 'http':
+        if args.url:
+            host, _, port = args.url.partition(':')
+            client = HttpClient(host, int(port or 80))
+        else:
+            from http_shim import start_server
+            server = start_server()
+            client = HttpClient('127.0.0.1', server.server_address[1])
+    else:
+        client = InProcessClient()
+
+    if args.warmup:
+        run_load(client, data, mix, args.concurrency, args.warmup, 0, args.seed + 1000)
+
+    try:
+        scenarios = run_load(client, data, mix, args.concurrency, args.duration, args.requests, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': git_revision(),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'env': overrides,
+        'dataset': {'users': data.users, 'events': data.events, 'registrations': data.registrations},
+        'scenarios': scenarios
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        report['regressions'] = regressions
+
+    print_table(scenarios)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if regressions:
+        print(f'Регрессия больше {args.max_regression}%: {", ".join(regressions)}', file=sys.stderr)
+        return 1
+    return 0
+
+def listing_cases() -> dict:
+    city, lat, lon = CITIES[0]
+    return {
+        'все опубликованные': {},
+        'город': {'city': city},
+        'город и категория': {'city': city, 'category': CATEGORIES[0]},
+        'поиск': {'q': WORDS[0]},
+        'рядом с точкой': {'lat': str(lat), 'lon': str(lon), 'radius_km': '10'},
+        'область карты': {'bbox': f'{lon - 0.2},{lat - 0.1},{lon + 0.2},{lat + 0.1}'}
+    }
+
+# Индексы миграции V0010 и одноколоночные индексы, которые она удалила: --compare-v0010 строит планы до и после неё
+V0010_INDEXES = (
+    'idx_events_published_date', 'idx_events_published_city_date', 'idx_events_published_category_date',
+    'idx_events_published_city_category_date', 'idx_events_organizer_date', 'idx_registrations_user_created'
+)
+PRE_V0010_INDEXES = (
+    f'CREATE INDEX idx_events_status ON {SCHEMA}.events(status)',
+    f'CREATE INDEX idx_events_organizer_id ON {SCHEMA}.events(organizer_id)',
+    f'CREATE INDEX idx_registrations_user_id ON {SCHEMA}.registrations(user_id)'
+)
+
+def explain_cases(events, dsn: str) -> list:
+    # Тот же SQL, что строит handler ленты; запрос регистраций повторяет get_user_registrations в payment
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT organizer_id FROM {SCHEMA}.events ORDER BY id LIMIT 1")
+            organizer_id = cur.fetchone()[0]
+            cur.execute(f"SELECT user_id FROM {SCHEMA}.registrations ORDER BY id LIMIT 1")
+            user_id = cur.fetchone()[0]
+    finally:
+        conn.close()
+
+    cases = []
+    for title, params in {**listing_cases(), 'мероприятия организатора': {'organizer_id': str(organizer_id)}}.items():
+        _, query = events.build_listing_query(params)
+        sql = events.events_select_sql(query['from_clause'], query['sort_key_column'], query['with_distance'])
+        cases.append((title, sql, query['params']))
+    cases.append(('регистрации пользователя', f"""
+        SELECT id, event_id, payment_status AS status, payment_amount AS amount, created_at, paid_at
+        FROM {SCHEMA}.registrations
+        WHERE user_id = %s
+        ORDER BY created_at DESC, id DESC
+    """, [user_id]))
+    return cases
+
+def explain_plan(cur, sql: str, params: list, repeat: int) -> tuple:
+    # Без замеров по узлам план повторяется от прогона к прогону и годится для diff; время берётся из итога
+    best_ms, best_plan = None, None
+    for _ in range(repeat):
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, COSTS OFF, TIMING OFF) ' + sql, params)
+        lines = [row[0] for row in cur.fetchall()]
+        execution_ms = float(re.search(r'Execution Time: ([\d.]+)', lines[-1]).group(1))
+        if best_ms is None or execution_ms < best_ms:
+            best_ms, best_plan = execution_ms, [line for line in lines if not line.startswith(('Planning', 'Execution'))]
+    return best_ms, best_plan
+
+def plan_indexes(plan: list) -> list:
+    return sorted({match for line in plan for match in re.findall(r'(?:using|on) (idx_\w+)', line)})
+
+def command_explain_v0010(args) -> int:
+    apply_env(args.env)
+    events = load_function('events')
+    cases = explain_cases(events, args.dsn)
+    conn = psycopg2.connect(args.dsn)
+    report = {}
+    try:
+        with conn.cursor() as cur:
+            # Первый прогон прогревает кэш, чтобы «после» и «до» читали одни и те же страницы из памяти
+            for title, sql, params in cases:
+                explain_plan(cur, sql, params, 1)
+                report[title] = {'after': explain_plan(cur, sql, params, args.repeat)}
+            # DROP INDEX держит ACCESS EXCLUSIVE до отката: режим только для локальной базы бенчмарков
+            cur.execute('DROP INDEX ' + ', '.join(f'{SCHEMA}.{name}' for name in V0010_INDEXES))
+            for statement in PRE_V0010_INDEXES:
+                cur.execute(statement)
+            for title, sql, params in cases:
+                report[title]['before'] = explain_plan(cur, sql, params, args.repeat)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    print(f'{"запрос":<28}{"до V0010, мс":>14}{"после, мс":>12}  индексы до -> после')
+    for title, result in report.items():
+        (before_ms, before_plan), (after_ms, after_plan) = result['before'], result['after']
+        print(f'{title:<28}{before_ms:>14.2f}{after_ms:>12.2f}  '
+              f'{",".join(plan_indexes(before_plan)) or "seq scan"} -> {",".join(plan_indexes(after_plan)) or "seq scan"}')
+    for title, result in report.items():
+        print(f'\n== {title}')
+        print('\n'.join(difflib.unified_diff(result['before'][1], result['after'][1], 'до V0010', 'после V0010', lineterm='')))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                title: {
+                    stage: {'execution_ms': result[stage][0], 'indexes': plan_indexes(result[stage][1]), 'plan': result[stage][1]}
+                    for stage in ('before', 'after')
+                } for title, result in report.items()
+            }, f, ensure_ascii=False, indent=2)
+    return 0
+
+def command_explain(args) -> int:
+    if args.compare_v0010:
+        return command_explain_v0010(args)
+    # Порог 0 и выборка 1 превращают журнал медленных запросов в сборщик планов ленты
+    apply_env(args.env + ['SLOW_QUERY_THRESHOLD_MS=0', 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1', 'LISTING_CACHE_TTL=0'])
+    events = load_function('events')
+    for title, params in listing_cases().items():
+        events.instrumentation.slow_queries.clear()
+        events.handler(get(params), None)
+        print(f'== {title}: {params}')
+        for entry in events.instrumentation.slow_queries:
+            if entry['plan']:
+                print(f'-- {entry["duration_ms"]} мс, строк: {entry["rows"]}')
+                print('\n'.join(entry['plan']))
+    return 0
+
+def parity_body(module, event: dict, sql_json: bool):
+    module.LISTING_SQL_JSON = sql_json
+    response = module.handler(event, None)
+    if response['statusCode'] != 200:
+        return response['statusCode']
+    return response['body']
+
+def command_parity(args) -> int:
+    # Ответ, собранный в Postgres (LISTING_SQL_JSON), должен побайтно совпадать с сериализацией строк в Python:
+    # от тела зависят ETag, сжатие и кэш на стороне клиента
+    apply_env(args.env + ['LISTING_CACHE_TTL=0'])
+    events = load_function('events')
+    payment = load_function('payment')
+    if args.without_orjson:
+        load_shared('runtime').orjson = None
+    data = Dataset(args.dsn)
+    rng = random.Random(args.seed)
+
+    cases = []
+    for title, params in listing_cases().items():
+        cases.append((f'лента, {title}', events, get({**params, 'limit': str(args.limit)})))
+        first_page = parity_body(events, get({**params, 'limit': str(args.limit)}), False)
+        next_cursor = json.loads(first_page)['next_cursor'] if isinstance(first_page, str) else None
+        if next_cursor:
+            cases.append((f'лента, {title}, вторая страница', events,
+                          get({**params, 'limit': str(args.limit), 'cursor': next_cursor})))
+    for user_id in rng.sample(range(1, data.users + 1), min(args.users, data.users)):
+        cases.append((f'регистрации пользователя {user_id}', payment, post({'action': 'get_user_registrations', 'user_id': user_id})))
+
+    mismatches = 0
+    for title, module, event in cases:
+        python_body = parity_body(module, event, False)
+        sql_body = parity_body(module, event, True)
+        if python_body == sql_body:
+            print(f'ok: {title}')
+            continue
+        mismatches += 1
+        print(f'расхождение: {title}', file=sys.stderr)
+        if isinstance(python_body, str) and isinstance(sql_body, str):
+            offset = next((i for i, (a, b) in enumerate(zip(python_body, sql_body)) if a != b), min(len(python_body), len(sql_body)))
+            print(f'  первое отличие на символе {offset}', file=sys.stderr)
+            print(f'  python: {python_body[max(offset - 200, 0):offset + 200]}', file=sys.stderr)
+            print(f'  sql:    {sql_body[max(offset - 200, 0):offset + 200]}', file=sys.stderr)
+        else:
+            print(f'  python: {python_body}', file=sys.stderr)
+            print(f'  sql:    {sql_body}', file=sys.stderr)
+    return 1 if mismatches else 0
+
+def command_oversell(args) -> int:
+    # Подписанные уведомления СБП идут через настоящую проверку подписи; секрет стенда, если не задан через --env
+    apply_env(args.env + ([] if os.environ.get('SBP_WEBHOOK_SECRET') else ['SBP_WEBHOOK_SECRET=bench-webhook-secret']),
+              args.concurrency)
+    data = Dataset(args.dsn)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {SCHEMA}.events (organizer_id, title, category, city, event_date, event_time, max_participants, status)
+                VALUES (1, 'Проверка переполнения', 'concert', 'Москва', CURRENT_DATE + 30, '19:00', %s, 'published')
+                RETURNING id
+            """, (args.seats,))
+            event_id = cur.fetchone()[0]
+        conn.commit()
+
+        handler = load_function('payment').handler
+        users = random.Random(args.seed).sample(range(1, data.users + 1), min(args.buyers + args.late_payments, data.users))
+        buyers, latecomers = users[:args.buyers], users[args.buyers:]
+        statuses = defaultdict(int)
+        lock = threading.Lock()
+
+        def buy(user_id: int) -> None:
+            status = handler(post({'action': 'create_payment', 'user_id': user_id, 'event_id': event_id, 'event_price': 100}), None)['statusCode']
+            with lock:
+                statuses[status] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(buy, buyers))
+        elapsed = time.monotonic() - started
+
+        late = race_late_payments(args, conn, handler, event_id, latecomers) if args.late_payments else None
+
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT e.seats_taken,
+                       (SELECT COUNT(*) FROM {SCHEMA}.registrations r
+                        WHERE r.event_id = e.id AND r.payment_status IN ('pending', 'paid'))
+                FROM {SCHEMA}.events e WHERE e.id = %s
+            """, (event_id,))
+            seats_taken, holds = cur.fetchone()
+            cur.execute(f"""
+                SELECT payment_status, COUNT(*) FROM {SCHEMA}.registrations
+                WHERE event_id = %s GROUP BY payment_status ORDER BY payment_status
+            """, (event_id,))
+            registrations = dict(cur.fetchall())
+    finally:
+        conn.close()
+
+    print(json.dumps({
+        'event_id': event_id,
+        'seats': args.seats,
+        'buyers': len(buyers),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'seconds': round(elapsed, 2),
+        'late_payments': late,
+        'registrations': registrations,
+        'seats_taken': seats_taken,
+        'holds': holds
+    }, ensure_ascii=False, indent=2))
+    if holds > args.seats or seats_taken != holds:
+        print('Мест продано больше, чем есть, или счётчик разошёлся с бронями', file=sys.stderr)
+        return 1
+    return 0
+
+def race_late_payments(args, conn, handler, event_id: int, latecomers: list) -> dict:
+    # Часть броней истекает и снимается воркером, после чего новые покупатели и запоздавшие
+    # подписанные уведомления СБП об оплате этих броней одновременно борются за освободившиеся места
+    from fake_sbp import build_notification
+    worker = load_function('worker')
+
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.registrations SET hold_expires_at = NOW() - INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM {SCHEMA}.registrations
+                WHERE event_id = %s AND payment_status = 'pending'
+                ORDER BY id LIMIT %s
+            )
+            RETURNING payment_id
+        """, (event_id, args.late_payments))
+        payment_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+
+    statuses = defaultdict(int)
+    lock = threading.Lock()
+
+    def pay(payment_id: str) -> None:
+        raw_body, headers = build_notification(payment_id, 'paid', os.environ['SBP_WEBHOOK_SECRET'])
+        response = handler({'httpMethod': 'POST', 'headers': headers, 'body': raw_body}, None)
+        with lock:
+            statuses[f"webhook {response['statusCode']} {json.loads(response['body']).get('result')}"] += 1
+
+    def buy(user_id: int) -> None:
+        status = handler(post({'action': 'create_payment', 'user_id': user_id, 'event_id': event_id, 'event_price': 100}), None)['statusCode']
+        with lock:
+            statuses[f'create_payment {status}'] += 1
+
+    # Воркер успевает снять брони раньше, чем приходит оплата: освободившиеся места разбирают новые покупатели
+    released = worker.release_expired_holds(conn, time.monotonic() + 60)['released']
+    tasks = [lambda p=p: pay(p) for p in payment_ids] + [lambda u=u: buy(u) for u in latecomers]
+    random.Random(args.seed).shuffle(tasks)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda task: task(), tasks))
+    return {'expired_holds': len(payment_ids), 'released': released, 'statuses': dict(sorted(statuses.items()))}
+
+def bulk_events(rng: random.Random, count: int, marker: str) -> list:
+    city, lat, lon = rng.choice(CITIES)
+    return [{
+        'title': f'{marker} {i}',
+        'description': ' '.join(rng.choice(WORDS) for _ in range(12)),
+        'category': rng.choice(CATEGORIES),
+        'city': city,
+        'event_date': '2027-01-15',
+        'event_time': '19:00',
+        'participant_price': 500,
+        'latitude': round(lat + rng.uniform(-0.1, 0.1), 6),
+        'longitude': round(lon + rng.uniform(-0.1, 0.1), 6),
+        'max_participants': 100
+    } for i in range(count)]
+
+def command_bulk(args) -> int:
+    # Один create_events_bulk против N последовательных create_event через тот же handler: разница — это
+    # N-1 круговых поездок, фиксаций и разборов запроса, которые пакет сводит к одному execute_values
+    apply_env(args.env)
+    handler = load_function('events').handler
+    rng = random.Random(args.seed)
+    marker = f'bench-bulk-{os.getpid()}'
+    results = {}
+    failed = False
+    try:
+        for size in [int(n) for n in args.sizes.split(',')]:
+            events = bulk_events(rng, size, marker)
+            started = time.perf_counter()
+            response = handler(post({'action': 'create_events_bulk', 'organizer_id': 1, 'events': events}), None)
+            bulk_s = time.perf_counter() - started
+            failed |= response['statusCode'] != 200
+
+            started = time.perf_counter()
+            for item in events:
+                response = handler(post({'action': 'create_event', 'organizer_id': 1, **item}), None)
+                failed |= response['statusCode'] != 200
+            single_s = time.perf_counter() - started
+
+            results[str(size)] = {
+                'bulk_ms': round(bulk_s * 1000, 1),
+                'single_ms': round(single_s * 1000, 1),
+                'bulk_events_per_s': round(size / bulk_s),
+                'single_events_per_s': round(size / single_s),
+                'speedup': round(single_s / bulk_s, 1)
+            }
+    finally:
+        conn = psycopg2.connect(args.dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {SCHEMA}.events WHERE organizer_id = 1 AND title LIKE %s", (marker + ' %',))
+            conn.commit()
+        finally:
+            conn.close()
+
+    print(json.dumps({'db_rtt_ms': args.db_rtt_ms, 'sizes': results}, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+class CountingSMTPHandler:
+    '''Заглушка SMTP-сервера: принимает письма и считает их вместе с входами, то есть открытыми соединениями'''
+
+    def __init__(self):
+        self.messages = 0
+        self.logins = 0
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        self.messages += 1
+        return '250 Message accepted for delivery'
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        from aiosmtpd.smtp import AuthResult
+        self.logins += 1
+        return AuthResult(success=True)
+
+def start_smtp_stub(workdir: str):
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise SystemExit('Для прогона outbox нужен aiosmtpd: pip install -r backend/bench/requirements.txt')
+
+    # SMTPSender всегда делает STARTTLS, поэтому заглушке нужен сертификат; самоподписанный не проверяется клиентом
+    cert, key = os.path.join(workdir, 'cert.pem'), os.path.join(workdir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                    '-days', '1', '-subj', '/CN=localhost'], check=True, capture_output=True)
+    tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    tls_context.load_cert_chain(cert, key)
+
+    # aiosmtpd сам трогает устаревший Session.login_data и предупреждает об этом на каждый вход
+    logging.getLogger('mail.log').setLevel(logging.ERROR)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    handler = CountingSMTPHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port, tls_context=tls_context,
+                            authenticator=handler.authenticate, auth_require_tls=True)
+    controller.start()
+    return controller, handler, port
+
+def per_message_sender(worker):
+    class PerMessageSMTPSender(worker.SMTPSender):
+        '''Отправка без общего соединения: подключение, STARTTLS и AUTH на каждое письмо'''
+
+        def send(self, to_email: str, subject: str, body: str) -> None:
+            if self._server is None:
+                self.ensure_connected()
+            try:
+                super().send(to_email, subject, body)
+            finally:
+                self.close()
+
+    return PerMessageSMTPSender()
+
+def command_outbox(args) -> int:
+    # Очередь писем разбирается настоящим drain_email_outbox; сравниваются только способы держать SMTP-соединение
+    with tempfile.TemporaryDirectory() as workdir:
+        controller, stub, port = start_smtp_stub(workdir)
+        try:
+            apply_env(args.env + [f'SMTP_HOST=127.0.0.1', f'SMTP_PORT={port}', 'SMTP_USER=bench@example.com',
+                                  'SMTP_PASSWORD=bench', f'EMAIL_BATCH_SIZE={args.batch_size}'])
+            worker = load_function('worker')
+            persistent_sender = worker.smtp_sender
+            body = '<p>' + ' '.join(WORDS) * 20 + '</p>'
+
+            results = {}
+            for mode in ('per_message', 'persistent'):
+                conn = psycopg2.connect(args.dsn)
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(f"""
+                            INSERT INTO {SCHEMA}.email_outbox (to_email, subject, body)
+                            SELECT 'outbox' || n || '@example.com', 'Проверка очереди писем', %s
+                            FROM generate_series(1, %s) n
+                            RETURNING id
+                        """, (body, args.emails))
+                        ids = [row[0] for row in cur.fetchall()]
+                    conn.commit()
+
+                    worker.smtp_sender = per_message_sender(worker) if mode == 'per_message' else persistent_sender
+                    messages, logins = stub.messages, stub.logins
+                    started = time.monotonic()
+                    totals = defaultdict(int)
+                    while True:
+                        drained = worker.drain_email_outbox(conn, time.monotonic() + 600)
+                        for key in ('sent', 'retried', 'failed'):
+                            totals[key] += drained[key]
+                        if drained['sent'] + drained['retried'] + drained['failed'] == 0:
+                            break
+                    elapsed = time.monotonic() - started
+                    worker.smtp_sender.close()
+
+                    with conn.cursor() as cur:
+                        cur.execute(f"SELECT COUNT(*) FILTER (WHERE status = 'sent') FROM {SCHEMA}.email_outbox WHERE id = ANY(%s)", (ids,))
+                        sent = cur.fetchone()[0]
+                        cur.execute(f"DELETE FROM {SCHEMA}.email_outbox WHERE id = ANY(%s)", (ids,))
+                    conn.commit()
+                finally:
+                    conn.close()
+
+                results[mode] = {
+                    'emails': args.emails,
+                    'sent': sent,
+                    'drained': dict(totals),
+                    'stub_messages': stub.messages - messages,
+                    'smtp_logins': stub.logins - logins,
+                    'seconds': round(elapsed, 2),
+                    'emails_per_s': round(sent / elapsed, 1) if elapsed else None
+                }
+        finally:
+            controller.stop()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0 if all(result['sent'] == args.emails for result in results.values()) else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочные прогоны handler функций')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE до загрузки функций')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db-rtt-ms', type=float, default=0,
+                        help='Пустить функции к базе через прокси с такой задержкой туда и обратно')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='Смешанная нагрузка с перцентилями по сценариям')
+    load.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    load.add_argument('--url', help='host:port уже запущенного сервера для режима http')
+    load.add_argument('--scenario', help='Сценарии с весами: list_events:3,login:1')
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--duration', type=float, default=30)
+    load.add_argument('--warmup', type=float, default=5)
+    load.add_argument('--requests', type=int, default=0, help='Остановиться после N запросов')
+    load.add_argument('--bulk-size', type=int, default=BULK_SIZE)
+    load.add_argument('--output')
+    load.add_argument('--baseline')
+    load.add_argument('--max-regression', type=float, default=10.0)
+    load.set_defaults(func=command_load)
+
+    explain = commands.add_parser('explain', help='EXPLAIN (ANALYZE, BUFFERS) запросов ленты')
+    explain.add_argument('--compare-v0010', action='store_true',
+                         help='Сравнить планы и время с индексами V0010 и без них (изменения откатываются)')
+    explain.add_argument('--repeat', type=int, default=5)
+    explain.add_argument('--output')
+    explain.set_defaults(func=command_explain)
+
+    parity = commands.add_parser('parity', help='Сравнить ответы LISTING_SQL_JSON=1 с сериализацией в Python')
+    parity.add_argument('--limit', type=int, default=200)
+    parity.add_argument('--users', type=int, default=20)
+    parity.add_argument('--without-orjson', action='store_true', help='Проверить запасную сериализацию через json')
+    parity.set_defaults(func=command_parity)
+
+    oversell = commands.add_parser('oversell', help='Конкурентные покупки последних мест')
+    oversell.add_argument('--seats', type=int, default=50)
+    oversell.add_argument('--buyers', type=int, default=500)
+    oversell.add_argument('--concurrency', type=int, default=32)
+    oversell.add_argument('--late-payments', type=int, default=0,
+                          help='Истечь столько броней и гонять их оплату с воркером и новыми покупателями')
+    oversell.set_defaults(func=command_oversell)
+
+    bulk = commands.add_parser('bulk', help='Пакетное создание мероприятий против N вызовов create_event')
+    bulk.add_argument('--sizes', default='100,1000', help='Размеры пакета')
+    bulk.set_defaults(func=command_bulk)
+
+    outbox = commands.add_parser('outbox', help='Разбор очереди писем через заглушку SMTP: соединение на письмо против общего')
+    outbox.add_argument('--emails', type=int, default=2000)
+    outbox.add_argument('--batch-size', type=int, default=50)
+    outbox.add_argument('--output')
+    outbox.set_defaults(func=command_outbox)
+
+    args = parser.parse_args()
+    if args.db_rtt_ms:
+        # Через прокси ходят только функции; подготовка и проверки стенда идут к базе напрямую
+        os.environ['DATABASE_URL'] = start_latency_proxy(args.dsn, args.db_rtt_ms)
+    sys.exit(args.func(args))
@@ -0,0 +1,168 @@
+'''Наполнение локальной PostgreSQL объёмами для нагрузочных тестов через generate_series
+
+Пример: python backend/bench/seed.py --reset --users 100000 --events 1000000 --registrations 10000000
+'''
+import argparse
+import os
+import time
+from urllib.parse import urlsplit
+
+import psycopg2
+
+from common import BENCH_PASSWORD, SCHEMA, apply_env, load_function
+
+CATEGORIES = ('concert', 'lecture', 'masterclass', 'party', 'sport', 'exhibition')
+# Город и координаты центра, вокруг которых разбрасываются мероприятия
+CITIES = (
+    ('Москва', 55.7558, 37.6173),
+    ('Санкт-Петербург', 59.9343, 30.3351),
+    ('Казань', 55.7961, 49.1064),
+    ('Новосибирск', 55.0084, 82.9357),
+    ('Екатеринбург', 56.8389, 60.6057),
+    ('Нижний Новгород', 56.2965, 43.9361),
+    ('Сочи', 43.6028, 39.7342),
+    ('Калининград', 54.7104, 20.4522),
+)
+WORDS = ('джаз', 'рок', 'лекция', 'история', 'йога', 'марафон', 'выставка', 'кино', 'стендап', 'театр')
+CHUNK_SIZE = 250000
+
+def insert_in_chunks(conn, label: str, total: int, sql: str, params: dict) -> None:
+    started = time.monotonic()
+    with conn.cursor() as cur:
+        for start in range(1, total + 1, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE - 1, total)
+            cur.execute(sql, {**params, 'start': start, 'end': end})
+            conn.commit()
+            print(f'{label}: {end}/{total} ({time.monotonic() - started:.0f} с)', flush=True)
+
+def seed_users(conn, users: int) -> None:
+    # Один хэш на всех: вход под любым benchN@example.com проверяет тот же PBKDF2
+    password_hash = load_function('auth').hash_password(BENCH_PASSWORD)
+    insert_in_chunks(conn, 'users', users, f"""
+        INSERT INTO {SCHEMA}.users (phone, password_hash, full_name, email)
+        SELECT '+7' || lpad(n::text, 10, '0'), %(password_hash)s, 'Участник ' || n, 'bench' || n || '@example.com'
+        FROM generate_series(%(start)s, %(end)s) n
+    """, {'password_hash': password_hash})
+
+def seed_events(conn, events: int, users: int) -> None:
+    insert_in_chunks(conn, 'events', events, f"""
+        INSERT INTO {SCHEMA}.events (
+            organizer_id, title, description, category, city, event_date, event_time,
+            participant_price, latitude, longitude, max_participants, status, created_at, updated_at
+        )
+        SELECT 1 + (n * 7) %% %(users)s,
+               initcap(words[1 + n %% cardinality(words)]) || ' ' || words[1 + (n / 11) %% cardinality(words)] || ' №' || n,
+               'Описание мероприятия ' || n || ': ' || words[1 + (n / 3) %% cardinality(words)],
+               categories[1 + n %% cardinality(categories)],
+               cities[1 + (n / 7) %% cardinality(cities)],
+               CURRENT_DATE + (n %% 400) - 30,
+               make_time(10 + n %% 12, (n %% 4) * 15, 0),
+               (n %% 10) * 100,
+               lats[1 + (n / 7) %% cardinality(cities)] + ((n * 37) %% 1000 - 500) / 2500.0,
+               lons[1 + (n / 7) %% cardinality(cities)] + ((n * 53) %% 1000 - 500) / 1500.0,
+               CASE WHEN n %% 5 = 0 THEN NULL ELSE 20 + n %% 480 END,
+               CASE WHEN n %% 10 < 8 THEN 'published' ELSE 'pending' END,
+               NOW() - (n %% 2000) * INTERVAL '1 hour',
+               NOW() - (n %% 2000) * INTERVAL '1 hour'
+        FROM generate_series(%(start)s, %(end)s) n,
+             (SELECT %(categories)s::text[] AS categories, %(cities)s::text[] AS cities,
+                     %(lats)s::float8[] AS lats, %(lons)s::float8[] AS lons, %(words)s::text[] AS words) dict
+    """, {
+        'users': users,
+        'categories': list(CATEGORIES),
+        'cities': [city for city, _, _ in CITIES],
+        'lats': [lat for _, lat, _ in CITIES],
+        'lons': [lon for _, _, lon in CITIES],
+        'words': list(WORDS)
+    })
+
+def seed_registrations(conn, registrations: int, users: int, events: int) -> None:
+    # Триггер event_stats на каждую строку замедлил бы вставку, сводка пересчитывается одним запросом в конце
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {SCHEMA}.registrations DISABLE TRIGGER USER")
+    conn.commit()
+    try:
+        insert_in_chunks(conn, 'registrations', registrations, f"""
+            INSERT INTO {SCHEMA}.registrations (
+                user_id, event_id, payment_status, payment_amount, event_price,
+                payment_id, payment_url, created_at, paid_at, hold_expires_at
+            )
+            SELECT 1 + n %% %(users)s,
+                   1 + ((n / %(users)s) * 7919 + n * 31) %% %(events)s,
+                   status, 100, 100,
+                   md5(n::text)::uuid::text, 'https://qr.nspk.ru/bench/' || n,
+                   NOW() - (n %% 5000) * INTERVAL '1 minute',
+                   CASE WHEN status = 'paid' THEN NOW() - (n %% 5000) * INTERVAL '1 minute' END,
+                   CASE WHEN status = 'pending' THEN NOW() + INTERVAL '15 minutes' END
+            FROM generate_series(%(start)s, %(end)s) n,
+                 LATERAL (SELECT CASE WHEN n %% 20 < 15 THEN 'paid' WHEN n %% 20 < 17 THEN 'pending' ELSE 'expired' END AS status) s
+            ON CONFLICT (user_id, event_id) DO NOTHING
+        """, {'users': users, 'events': events})
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {SCHEMA}.registrations ENABLE TRIGGER USER")
+        conn.commit()
+
+def rebuild_counters(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.events e
+            SET seats_taken = r.taken
+            FROM (
+                SELECT event_id, COUNT(*) AS taken FROM {SCHEMA}.registrations
+                WHERE payment_status IN ('pending', 'paid')
+                GROUP BY event_id
+            ) r
+            WHERE e.id = r.event_id
+        """)
+        cur.execute(f"TRUNCATE {SCHEMA}.event_stats")
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.event_stats (event_id, registrations_count, paid_count, revenue)
+            SELECT event_id,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE payment_status = 'paid'),
+                   COALESCE(SUM(payment_amount) FILTER (WHERE payment_status = 'paid'), 0)
+            FROM {SCHEMA}.registrations
+            WHERE payment_status IN ('pending', 'paid')
+            GROUP BY event_id
+        """)
+    conn.commit()
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for table in ('users', 'events', 'registrations', 'event_stats'):
+            cur.execute(f"VACUUM ANALYZE {SCHEMA}.{table}")
+    conn.autocommit = False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Наполнить базу тестовыми данными')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--registrations', type=int, default=10000000)
+    parser.add_argument('--reset', action='store_true', help='Очистить таблицы перед наполнением')
+    parser.add_argument('--allow-remote', action='store_true', help='Разрешить базу не на localhost')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE до загрузки функций')
+    args = parser.parse_args()
+
+    host = urlsplit(args.dsn or '').hostname
+    if host not in ('localhost', '127.0.0.1', '::1', None) and not args.allow_remote:
+        parser.error(f'База {host} не локальная; добавьте --allow-remote, если это действительно стенд')
+
+    apply_env(args.env)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.reset:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    TRUNCATE {SCHEMA}.registrations, {SCHEMA}.event_publications, {SCHEMA}.event_stats,
+                             {SCHEMA}.events, {SCHEMA}.users
+                    RESTART IDENTITY CASCADE
+                """)
+            conn.commit()
+        seed_users(conn, args.users)
+        seed_events(conn, args.events, args.users)
+        seed_registrations(conn, args.registrations, args.users, args.events)
+        rebuild_counters(conn)
+    finally:
+        conn.close()
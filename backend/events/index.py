@@ -1,11 +1,187 @@
 import json
 import os
+import base64
+import hashlib
+import math
+import threading
+import time
 import psycopg2
 import uuid
-from datetime import datetime
+from psycopg2.extras import execute_values
+from db_pool import ConnectionPool
+from session_tokens import verify_session_token
+from runtime import Instrumentation, TimingCursorMixin, compress_response, dumps, get_header, is_admin_request, phase, sql_isoformat
+from collections import OrderedDict
+from datetime import date, time as dt_time, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+METRICS_ACTIONS = ('list_events', 'stats', 'metrics', 'slow_queries', 'create_event', 'create_events_bulk', 'organizer_stats', 'pay_publication', 'confirm_publication')
+instrumentation = Instrumentation('events', METRICS_ACTIONS)
+
+EVENTS_PAGE_DEFAULT_LIMIT = int(os.environ.get('EVENTS_PAGE_DEFAULT_LIMIT', '50'))
+EVENTS_PAGE_MAX_LIMIT = int(os.environ.get('EVENTS_PAGE_MAX_LIMIT', '200'))
+GEO_DEFAULT_RADIUS_KM = 10.0
+GEO_MAX_RADIUS_KM = 200.0
+GEO_CELLS_PER_DEGREE = 10
+GEO_CELLS_PER_ROW = 360 * GEO_CELLS_PER_DEGREE
+GEO_MAX_CELL_ROWS = 64
+EARTH_RADIUS_KM = 6371.0
+# Градус меридиана на той же сфере, что и haversine в запросе, иначе рамка предфильтра уже круга поиска
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+GEO_BBOX_PAD_DEGREES = 1e-6
+LISTING_CACHE_TTL = float(os.environ.get('LISTING_CACHE_TTL', '30'))
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get('LISTING_CACHE_MAX_ENTRIES', '256'))
+LISTING_CACHE_PARAMS = ('category', 'city', 'q', 'lat', 'lon', 'radius_km', 'bbox', 'cursor')
+LISTING_SQL_JSON = os.environ.get('LISTING_SQL_JSON') == '1'
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED') == '1'
+EVENTS_BULK_MAX_ITEMS = int(os.environ.get('EVENTS_BULK_MAX_ITEMS', '10000'))
+EVENTS_BULK_PAGE_SIZE = int(os.environ.get('EVENTS_BULK_PAGE_SIZE', '1000'))
+# Верхняя граница столбцов INTEGER: большее число сорвало бы вставку всей пачки
+INT4_MAX = 2147483647
+EVENT_FIELDS = (
+    'id', 'title', 'description', 'category', 'city', 'date', 'time', 'participant_price',
+    'latitude', 'longitude', 'max_participants', 'status', 'organizer_name', 'created_at'
+)
+ORGANIZER_STATS_FIELDS = (
+    'id', 'title', 'date', 'status', 'max_participants', 'registrations', 'paid', 'revenue'
+)
+
+class MemoryCache:
+    '''TTL + LRU кэш готовых тел ответов в памяти экземпляра функции'''
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class RedisCache:
+    '''Общий кэш в Redis-совместимом хранилище: нужен клиент с get/set/incr'''
+
+    def __init__(self, client, ttl: float, prefix: str = 'events:listing:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.client.get(f'{self.prefix}{self._generation()}:{key}')
+        except Exception as e:
+            print(f"Ошибка чтения кэша: {str(e)}")
+            return None
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.client.set(f'{self.prefix}{self._generation()}:{key}', value, ex=max(int(self.ttl), 1))
+        except Exception as e:
+            print(f"Ошибка записи кэша: {str(e)}")
+
+    def invalidate(self) -> None:
+        try:
+            self.client.incr(f'{self.prefix}generation')
+        except Exception as e:
+            print(f"Ошибка сброса кэша: {str(e)}")
+
+    def _generation(self) -> int:
+        return int(self.client.get(f'{self.prefix}generation') or 0)
+
+def create_listing_cache():
+    redis_url = os.environ.get('REDIS_URL')
+    if redis_url and redis is not None:
+        return RedisCache(redis.Redis.from_url(redis_url), LISTING_CACHE_TTL)
+    return MemoryCache(LISTING_CACHE_MAX_ENTRIES, LISTING_CACHE_TTL)
+
+listing_cache = create_listing_cache()
+
+def normalize_listing_params(query_params: dict) -> dict:
+    # Ключ кэша и SQL строятся из одного словаря: иначе ?city=%20Москва кэшировал бы пустую ленту под ключом Москвы
+    return {name: value.strip() for name, value in query_params.items() if isinstance(value, str) and value.strip()}
+
+def listing_cache_key(query_params: dict) -> Optional[str]:
+    if query_params.get('organizer_id'):
+        return None
+    try:
+        limit = parse_limit(query_params.get('limit'))
+    except ValueError:
+        return None
+    key = {name: query_params[name] for name in LISTING_CACHE_PARAMS if query_params.get(name)}
+    key['limit'] = limit
+    return json.dumps(key, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+class TimedCursor(TimingCursorMixin, psycopg2.extensions.cursor):
+    instrumentation = instrumentation
+
+db_pool = ConnectionPool.from_env(cursor_factory=TimedCursor)
+instrumentation.pool = db_pool
+
+def get_db_connection():
+    with phase('db_connect'):
+        return db_pool.getconn()
+
+def release_db_connection(conn) -> None:
+    db_pool.putconn(conn)
+
+def auth_required_response() -> dict:
+    return {
+        'statusCode': 401,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Требуется авторизация'}),
+        'isBase64Encoded': False
+    }
+
+def authenticate(event: dict) -> tuple:
+    token = get_header(event, 'X-Auth-Token')
+    if not token:
+        if AUTH_REQUIRED:
+            return None, auth_required_response()
+        return None, None
+
+    claims = verify_session_token(token)
+    if claims is None:
+        return None, {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    return claims, None
+
+@instrumentation.instrumented
 def handler(event: dict, context) -> dict:
     '''API для управления мероприятиями: создание, получение списка, оплата публикации'''
+    return compress_response(event, route_request(event))
+
+def route_request(event: dict) -> dict:
     method = event.get('httpMethod', 'GET')
 
     if method == 'OPTIONS':
@@ -14,22 +190,77 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, If-None-Match, If-Modified-Since'
             },
             'body': '',
             'isBase64Encoded': False
         }
 
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    query_params = event.get('queryStringParameters') or {}
+    if query_params.get('action') == 'metrics':
+        instrumentation.label_request('metrics')
+        return instrumentation.metrics_response(event)
+
+    if method == 'GET':
+        instrumentation.label_request('list_events')
+        query_params = normalize_listing_params(query_params)
+    cache_key = listing_cache_key(query_params) if method == 'GET' else None
+
+    if cache_key:
+        cached = cached_listing_response(event, cache_key)
+        if cached is not None:
+            return cached
+
+    conn = get_db_connection()
     cur = conn.cursor()
 
     try:
         if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
+            content_type = get_header(event, 'Content-Type') or ''
+            if 'ndjson' in content_type:
+                body = {
+                    'action': 'create_events_bulk',
+                    'organizer_id': query_params.get('organizer_id'),
+                    'events': parse_ndjson(event.get('body') or '')
+                }
+            else:
+                body = json.loads(event.get('body', '{}'))
             action = body.get('action')
+            instrumentation.label_request(action)
 
-            if action == 'create_event':
+            if action in ('create_event', 'create_events_bulk', 'pay_publication', 'organizer_stats'):
+                claims, error = authenticate(event)
+                if error:
+                    return error
+                if claims:
+                    body['organizer_id'] = claims['sub']
+                elif action == 'organizer_stats':
+                    # Выручку и оплаты организатора отдаём только ему самому, organizer_id из тела не принимается
+                    return auth_required_response()
+
+            if action == 'stats':
+                if not is_admin_request(event):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Доступ запрещён'}),
+                        'isBase64Encoded': False
+                    }
+
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'db_pool': db_pool.stats()}),
+                    'isBase64Encoded': False
+                }
+
+            elif action == 'metrics':
+                return instrumentation.metrics_response(event)
+
+            elif action == 'slow_queries':
+                return instrumentation.slow_queries_response(event)
+
+            elif action == 'create_event':
                 organizer_id = body.get('organizer_id')
                 title = body.get('title')
                 description = body.get('description')
@@ -57,6 +288,12 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
 
+            elif action == 'create_events_bulk':
+                return create_events_bulk(conn, body.get('organizer_id'), body.get('events'))
+
+            elif action == 'organizer_stats':
+                return organizer_stats(conn, body.get('organizer_id'))
+
             elif action == 'pay_publication':
                 event_id = body.get('event_id')
                 organizer_id = body.get('organizer_id')
@@ -112,8 +349,9 @@ def handler(event: dict, context) -> dict:
                     }
 
                 event_id = result[0]
-                cur.execute("UPDATE events SET status = 'published' WHERE id = %s", (event_id,))
+                cur.execute("UPDATE events SET status = 'published', updated_at = CURRENT_TIMESTAMP WHERE id = %s", (event_id,))
                 conn.commit()
+                listing_cache.invalidate()
 
                 return {
                     'statusCode': 200,
@@ -123,62 +361,10 @@ def handler(event: dict, context) -> dict:
                 }
 
         elif method == 'GET':
-            query_params = event.get('queryStringParameters') or {}
-            category = query_params.get('category')
-            city = query_params.get('city')
-            organizer_id = query_params.get('organizer_id')
-
-            sql = """
-                SELECT e.id, e.title, e.description, e.category, e.city, e.event_date, e.event_time, 
-                       e.participant_price, e.latitude, e.longitude, e.max_participants, e.status,
-                       u.full_name as organizer_name, e.created_at
-                FROM events e
-                JOIN users u ON e.organizer_id = u.id
-                WHERE e.status = 'published'
-            """
-            params = []
-
-            if organizer_id:
-                sql = sql.replace("WHERE e.status = 'published'", "WHERE e.organizer_id = %s")
-                params.append(int(organizer_id))
-            else:
-                if category:
-                    sql += " AND e.category = %s"
-                    params.append(category)
-                if city:
-                    sql += " AND e.city = %s"
-                    params.append(city)
-
-            sql += " ORDER BY e.event_date ASC"
-
-            cur.execute(sql, params)
-            rows = cur.fetchall()
-
-            events = []
-            for row in rows:
-                events.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'description': row[2],
-                    'category': row[3],
-                    'city': row[4],
-                    'date': str(row[5]),
-                    'time': str(row[6]),
-                    'participant_price': row[7],
-                    'latitude': float(row[8]) if row[8] else None,
-                    'longitude': float(row[9]) if row[9] else None,
-                    'max_participants': row[10],
-                    'status': row[11],
-                    'organizer_name': row[12],
-                    'created_at': row[13].isoformat()
-                })
-
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'events': events}),
-                'isBase64Encoded': False
-            }
+            response = list_events(conn, event, query_params)
+            if cache_key and response['statusCode'] == 200:
+                cache_listing_response(cache_key, response)
+            return response
 
     except Exception as e:
         conn.rollback()
@@ -190,11 +376,548 @@ def handler(event: dict, context) -> dict:
         }
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'body': json.dumps({'error': 'Method not allowed'}),
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
+
+def cached_listing_response(event: dict, cache_key: str) -> Optional[dict]:
+    cached = listing_cache.get(cache_key)
+    if cached is None:
+        return None
+    etag, last_modified, cached_body = cached.split('\n', 2)
+    headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'}
+    headers.update(validator_headers(etag, last_modified))
+    return conditional_response(event, {
+        'statusCode': 200,
+        'headers': headers,
+        'body': cached_body,
+        'isBase64Encoded': False
+    })
+
+def cache_listing_response(cache_key: str, response: dict) -> None:
+    # Тело JSON не содержит переводов строк, поэтому валидаторы хранятся перед ним
+    listing_cache.set(cache_key, '\n'.join([
+        response['headers']['ETag'],
+        response['headers'].get('Last-Modified', ''),
+        response['body']
+    ]))
+
+def parse_ndjson(raw_body: str) -> list:
+    items = []
+    for line in raw_body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(line)
+    return items
+
+def validate_bulk_event(item) -> tuple:
+    if not isinstance(item, dict):
+        return None, ['Ожидается JSON-объект']
+
+    errors = []
+    for field, max_length in (('title', 255), ('category', 50), ('city', 100)):
+        value = item.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f'Поле {field} обязательно')
+        elif len(value) > max_length:
+            errors.append(f'Поле {field} длиннее {max_length} символов')
+
+    try:
+        event_date = date.fromisoformat(item.get('event_date'))
+    except (TypeError, ValueError):
+        event_date = None
+        errors.append('event_date должна быть в формате ГГГГ-ММ-ДД')
+    try:
+        event_time = dt_time.fromisoformat(item.get('event_time'))
+    except (TypeError, ValueError):
+        event_time = None
+        errors.append('event_time должно быть в формате ЧЧ:ММ')
+
+    numbers = {}
+    for field, low, high, integer in (
+        ('participant_price', 0, INT4_MAX, True),
+        ('max_participants', 1, INT4_MAX, True),
+        ('latitude', -90, 90, False),
+        ('longitude', -180, 180, False),
+    ):
+        value = item.get(field)
+        if value is None:
+            numbers[field] = 0 if field == 'participant_price' else None
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f'Поле {field} должно быть {"целым числом" if integer else "числом"}')
+            continue
+        # json.loads принимает NaN и Infinity; NaN не меньше и не больше ни одной границы и прошёл бы проверку диапазона
+        if isinstance(value, float) and not math.isfinite(value):
+            errors.append(f'Поле {field} должно быть конечным числом')
+            continue
+        if integer and isinstance(value, float) and not value.is_integer():
+            errors.append(f'Поле {field} должно быть целым числом')
+            continue
+        if value < low or (high is not None and value > high):
+            errors.append(f'Поле {field} вне допустимого диапазона')
+            continue
+        numbers[field] = int(value) if integer else value
+
+    if errors:
+        return None, errors
+
+    return (
+        item['title'], item.get('description'), item['category'], item['city'], event_date, event_time,
+        numbers['participant_price'], numbers['latitude'], numbers['longitude'], numbers['max_participants']
+    ), []
+
+def create_events_bulk(conn, organizer_id, items) -> dict:
+    if not organizer_id or not isinstance(items, list) or not items:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Укажите organizer_id и непустой список events'}),
+            'isBase64Encoded': False
+        }
+
+    if len(items) > EVENTS_BULK_MAX_ITEMS:
+        return {
+            'statusCode': 413,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Не более {EVENTS_BULK_MAX_ITEMS} мероприятий за один запрос'}),
+            'isBase64Encoded': False
+        }
+
+    # Сначала проверяется весь пакет: в базу не попадает ничего, если ошибочен хотя бы один элемент
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        row, item_errors = validate_bulk_event(item)
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            rows.append((organizer_id,) + row)
+
+    if errors:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Пакет содержит ошибки, ничего не создано', 'errors': errors}),
+            'isBase64Encoded': False
+        }
+
+    with conn.cursor() as cur:
+        # RETURNING многострочного VALUES отдаёт id в порядке строк пакета
+        created = execute_values(cur, """
+            INSERT INTO events (organizer_id, title, description, category, city, event_date, event_time, participant_price, latitude, longitude, max_participants)
+            VALUES %s
+            RETURNING id
+        """, rows, page_size=EVENTS_BULK_PAGE_SIZE, fetch=True)
+    conn.commit()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'created': len(created),
+            'results': [{'index': index, 'event_id': row[0]} for index, row in enumerate(created)]
+        }),
+        'isBase64Encoded': False
+    }
+
+def organizer_stats(conn, organizer_id) -> dict:
+    if not organizer_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Укажите organizer_id'}),
+            'isBase64Encoded': False
+        }
+
+    # Счётчики ведёт триггер на registrations, поэтому чтение не зависит от числа регистраций
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT e.id, e.title, e.event_date, e.status, e.max_participants,
+                   COALESCE(s.registrations_count, 0), COALESCE(s.paid_count, 0), COALESCE(s.revenue, 0)
+            FROM events e
+            LEFT JOIN event_stats s ON s.event_id = e.id
+            WHERE e.organizer_id = %s
+            ORDER BY e.event_date, e.id
+        """, (organizer_id,))
+        rows = cur.fetchall()
+
+    events = [dict(zip(ORGANIZER_STATS_FIELDS, row)) for row in rows]
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'events': events,
+            'totals': {
+                'events': len(events),
+                'registrations': sum(e['registrations'] for e in events),
+                'paid': sum(e['paid'] for e in events),
+                'revenue': sum(e['revenue'] for e in events)
+            }
+        }),
+        'isBase64Encoded': False
+    }
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str) -> list:
+    padded = token + '=' * (-len(token) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    if not isinstance(values, list):
+        raise ValueError('invalid cursor')
+    return values
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return EVENTS_PAGE_DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('invalid limit')
+    return min(limit, EVENTS_PAGE_MAX_LIMIT)
+
+def parse_geo_params(query_params: dict) -> Optional[dict]:
+    lat = query_params.get('lat')
+    lon = query_params.get('lon')
+    bbox = query_params.get('bbox')
+
+    if lat is None and lon is None and not bbox:
+        return None
+
+    geo = {'center': None, 'radius_km': None, 'bbox': None}
+
+    if lat is not None or lon is not None:
+        lat, lon = float(lat), float(lon)
+        radius_km = float(query_params.get('radius_km') or GEO_DEFAULT_RADIUS_KM)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius_km <= GEO_MAX_RADIUS_KM):
+            raise ValueError('invalid coordinates')
+        geo['center'] = (lat, lon)
+        geo['radius_km'] = radius_km
+        dlat = radius_km / KM_PER_DEGREE + GEO_BBOX_PAD_DEGREES
+        # Крайняя долгота круга на сфере: asin(sin(r/R) / cos(lat)), что шире r / (R * cos(lat)) у высоких широт
+        sin_radius = math.sin(radius_km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(lat))
+        if sin_radius >= cos_lat:
+            dlon = 180.0
+        else:
+            dlon = min(math.degrees(math.asin(sin_radius / cos_lat)) + GEO_BBOX_PAD_DEGREES, 180.0)
+        west = -180.0 if dlon >= 180 else (lon - dlon + 540) % 360 - 180
+        east = 180.0 if dlon >= 180 else (lon + dlon + 540) % 360 - 180
+        geo['bbox'] = (west, max(lat - dlat, -90.0), east, min(lat + dlat, 90.0))
+
+    if bbox:
+        west, south, east, north = (float(part) for part in bbox.split(','))
+        if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+            raise ValueError('invalid bbox')
+        geo['bbox'] = (west, south, east, north)
+
+    return geo
+
+def geo_cell_ranges(west: float, south: float, east: float, north: float) -> Optional[list]:
+    max_row = 180 * GEO_CELLS_PER_DEGREE
+    first_row = max(math.floor((south + 90) * GEO_CELLS_PER_DEGREE - 1e-6), 0)
+    last_row = min(math.floor((north + 90) * GEO_CELLS_PER_DEGREE + 1e-6), max_row)
+    if last_row - first_row + 1 > GEO_MAX_CELL_ROWS:
+        return None
+
+    first_col = max(math.floor((west + 180) * GEO_CELLS_PER_DEGREE - 1e-6), 0)
+    last_col = min(math.floor((east + 180) * GEO_CELLS_PER_DEGREE + 1e-6), GEO_CELLS_PER_ROW - 1)
+    if west <= east:
+        columns = [(first_col, last_col)]
+    else:
+        columns = [(first_col, GEO_CELLS_PER_ROW - 1), (0, last_col)]
+
+    return [
+        (row * GEO_CELLS_PER_ROW + low, row * GEO_CELLS_PER_ROW + high)
+        for row in range(first_row, last_row + 1)
+        for low, high in columns
+    ]
+
+def build_listing_query(query_params: dict) -> tuple:
+    category = query_params.get('category')
+    city = query_params.get('city')
+    organizer_id = query_params.get('organizer_id')
+
+    try:
+        geo = parse_geo_params(query_params)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректные координаты'}),
+            'isBase64Encoded': False
+        }, None
+
+    search_query = (query_params.get('q') or '').strip()
+    if geo and geo['center']:
+        sort_mode = 'distance'
+    elif search_query:
+        sort_mode = 'rank'
+    else:
+        sort_mode = 'date'
+
+    try:
+        limit = parse_limit(query_params.get('limit'))
+        after = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+        if after is not None:
+            key_type = str if sort_mode == 'date' else (int, float)
+            if len(after) != 2 or not isinstance(after[0], key_type) or not isinstance(after[1], int):
+                raise ValueError('invalid cursor')
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректные параметры пагинации'}),
+            'isBase64Encoded': False
+        }, None
+
+    joins = ["JOIN users u ON e.organizer_id = u.id"]
+    conditions = []
+    params = []
+
+    if search_query:
+        joins.append("CROSS JOIN websearch_to_tsquery('russian', %s) AS query")
+        params.append(search_query)
+        if sort_mode == 'rank':
+            joins.append("CROSS JOIN LATERAL (SELECT ts_rank(e.search_vector, query) AS rank) r")
+
+    if sort_mode == 'distance':
+        lat, lon = geo['center']
+        joins.append("""CROSS JOIN LATERAL (
+            SELECT 2 * %s::float8 * asin(sqrt(
+                power(sin(radians(e.latitude - %s::float8) / 2), 2) +
+                cos(radians(%s::float8)) * cos(radians(e.latitude)) * power(sin(radians(e.longitude - %s::float8) / 2), 2)
+            )) AS distance_km
+        ) d""")
+        params.extend([EARTH_RADIUS_KM, lat, lat, lon])
+
+    if organizer_id:
+        conditions.append("e.organizer_id = %s")
+        params.append(int(organizer_id))
+    else:
+        conditions.append("e.status = 'published'")
+        if category:
+            conditions.append("e.category = %s")
+            params.append(category)
+        if city:
+            conditions.append("e.city = %s")
+            params.append(city)
+
+    if search_query:
+        conditions.append("e.search_vector @@ query")
+
+    if geo:
+        west, south, east, north = geo['bbox']
+        cell_ranges = geo_cell_ranges(west, south, east, north)
+        if cell_ranges:
+            conditions.append('(' + ' OR '.join(["e.geo_cell BETWEEN %s AND %s"] * len(cell_ranges)) + ')')
+            for low, high in cell_ranges:
+                params.extend([low, high])
+        if west <= east:
+            bounds = "e.latitude BETWEEN %s::float8 AND %s::float8 AND e.longitude BETWEEN %s::float8 AND %s::float8"
+        else:
+            bounds = "e.latitude BETWEEN %s::float8 AND %s::float8 AND (e.longitude >= %s::float8 OR e.longitude <= %s::float8)"
+        if cell_ranges:
+            # Точные границы почти совпадают с ячейками geo_cell, но планировщик перемножает их избирательность
+            # и ждёт единицы строк вместо тысяч: для плотной области выбирает сортировку всех найденных строк
+            # вместо обхода индекса по дате. Внутри CASE условие не разбирается и оценивается как 0.5
+            bounds = f"CASE WHEN {bounds} THEN true ELSE false END"
+        conditions.append(bounds)
+        params.extend([south, north, west, east])
+
+    if sort_mode == 'distance':
+        conditions.append("d.distance_km <= %s::float8")
+        params.append(geo['radius_km'])
+        sort_key_column = "d.distance_km"
+        order_by = "d.distance_km ASC, e.id ASC"
+        after_condition = "(d.distance_km, e.id) > (%s::float8, %s)"
+    elif sort_mode == 'rank':
+        sort_key_column = "r.rank"
+        order_by = "r.rank DESC, e.id DESC"
+        after_condition = "(r.rank, e.id) < (%s::real, %s)"
+    else:
+        sort_key_column = "e.event_date::text"
+        order_by = "e.event_date ASC, e.id ASC"
+        after_condition = "(e.event_date, e.id) > (%s::text::date, %s)"
+
+    if after:
+        conditions.append(after_condition)
+        params.extend(after)
+
+    from_clause = f"""
+        FROM events e
+        {' '.join(joins)}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order_by}
+        LIMIT %s
+    """
+    params.append(limit + 1)
+
+    return None, {
+        'from_clause': from_clause,
+        'params': params,
+        'limit': limit,
+        'order_by': order_by,
+        'sort_key_column': sort_key_column,
+        'with_distance': sort_mode == 'distance'
+    }
+
+def list_events(conn, event: dict, query_params: dict) -> dict:
+    error, query = build_listing_query(query_params)
+    if error:
+        return error
+
+    # Валидаторы известны до запроса страницы: совпавший If-None-Match отвечается 304 без выборки и сериализации
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, changed_at FROM listing_version")
+        version, changed_at = cur.fetchone() or (0, None)
+    headers = listing_headers(query_params, version, changed_at)
+    if is_not_modified(event, headers['ETag'], headers.get('Last-Modified')):
+        return not_modified_response(headers)
+
+    if LISTING_SQL_JSON:
+        body = fetch_events_json(conn, query['from_clause'], query['params'], query['limit'],
+                                 query['order_by'], query['sort_key_column'], query['with_distance'])
+    else:
+        body = fetch_events(conn, query['from_clause'], query['params'], query['limit'],
+                            query['sort_key_column'], query['with_distance'])
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def listing_headers(query_params: dict, version: int, changed_at) -> dict:
+    # Тело ленты определяется параметрами и содержимым events, а версия меняется триггером при каждой правке ленты
+    params = json.dumps(query_params, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    headers.update(validator_headers(
+        make_etag(f'{version}:{params}'),
+        format_datetime(changed_at.replace(tzinfo=timezone.utc), usegmt=True) if changed_at else ''
+    ))
+    return headers
+
+def make_etag(source: str) -> str:
+    return '"' + hashlib.sha1(source.encode('utf-8')).hexdigest() + '"'
+
+def validator_headers(etag: str, last_modified: str) -> dict:
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return headers
+
+def is_not_modified(event: dict, etag: str, last_modified: Optional[str]) -> bool:
+    if_none_match = get_header(event, 'If-None-Match')
+    if if_none_match:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag.removeprefix('W/') in tags
+
+    if_modified_since = get_header(event, 'If-Modified-Since')
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+def conditional_response(event: dict, response: dict) -> dict:
+    headers = response['headers']
+    if not is_not_modified(event, headers['ETag'], headers.get('Last-Modified')):
+        return response
+    return not_modified_response(headers)
+
+def not_modified_response(headers: dict) -> dict:
+    return {
+        'statusCode': 304,
+        'headers': {key: value for key, value in headers.items() if key != 'Content-Type'},
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def events_select_sql(from_clause: str, sort_key_column: str, with_distance: bool) -> str:
+    distance_column = ", round(d.distance_km::numeric, 3)" if with_distance else ""
+    return f"""
+        SELECT e.id, e.title, e.description, e.category, e.city, e.event_date, e.event_time, 
+               e.participant_price, e.latitude, e.longitude, e.max_participants, e.status,
+               u.full_name as organizer_name, e.created_at{distance_column}, {sort_key_column}
+        {from_clause}
+    """
+
+def fetch_events(conn, from_clause: str, params: list, limit: int, sort_key_column: str, with_distance: bool) -> str:
+    # Страницу ограничивает LIMIT, поэтому обычный курсор забирает её за один запрос без DECLARE/FETCH
+    cur = conn.cursor()
+    try:
+        cur.execute(events_select_sql(from_clause, sort_key_column, with_distance), params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    return events_page_body(rows[:limit], len(rows) > limit, with_distance)
+
+def events_page_body(rows: list, has_more: bool, with_distance: bool) -> str:
+    next_cursor = encode_cursor([rows[-1][-1], rows[-1][0]]) if has_more else None
+
+    fields = EVENT_FIELDS + ('distance_km',) if with_distance else EVENT_FIELDS
+    with phase('serialize'):
+        # Объект JSON из кортежа orjson и json собирают только через dict; dict(zip()) строится целиком в C.
+        # Шаблон с готовыми ключами и значениями по одному в несколько раз медленнее (backend/bench/micro.py),
+        # путь совсем без строк Python — LISTING_SQL_JSON
+        events = [dict(zip(fields, row)) for row in rows]
+        return dumps({'events': events, 'next_cursor': next_cursor})
+
+def sql_json_float(column: str) -> str:
+    # Python отдаёт float с дробной частью (0.0, 55.0), float8 в JSON Postgres — без неё (0, 55)
+    return (
+        f"(CASE WHEN {column} = trunc({column}) THEN trunc({column})::bigint::text || '.0' "
+        f"ELSE {column}::float8::text END)::json"
+    )
+
+def fetch_events_json(conn, from_clause: str, params: list, limit: int, order_by: str, sort_key_column: str, with_distance: bool) -> str:
+    distance_field = f", {sql_json_float('round(d.distance_km::numeric, 3)')} AS distance_km" if with_distance else ""
+    cur = conn.cursor()
+
+    try:
+        # row_to_json и string_agg дают компактный JSON без пробелов json_build_object и переводов строк json_agg;
+        # числа и время приводятся к тому же виду, что у сериализации строк в Python
+        cur.execute(f"""
+            SELECT '[' || COALESCE(string_agg(page.doc::text, ',' ORDER BY page.rn) FILTER (WHERE page.rn <= %s), '') || ']',
+                   count(*) > %s,
+                   (array_agg(page.sort_key ORDER BY page.rn DESC) FILTER (WHERE page.rn <= %s))[1],
+                   (array_agg(page.id ORDER BY page.rn DESC) FILTER (WHERE page.rn <= %s))[1]
+            FROM (
+                SELECT (SELECT row_to_json(doc) FROM (SELECT
+                           e.id, e.title, e.description, e.category, e.city,
+                           e.event_date::text AS date,
+                           {sql_isoformat("('2000-01-01'::date + e.event_time)", 'HH24:MI:SS')} AS time,
+                           e.participant_price,
+                           {sql_json_float('e.latitude')} AS latitude, {sql_json_float('e.longitude')} AS longitude,
+                           e.max_participants, e.status,
+                           u.full_name AS organizer_name, {sql_isoformat('e.created_at')} AS created_at
+                           {distance_field}
+                       ) doc) AS doc,
+                       e.id,
+                       {sort_key_column} AS sort_key,
+                       row_number() OVER (ORDER BY {order_by}) AS rn
+                {from_clause}
+            ) page
+        """, [limit] * 4 + params)
+        events_json, has_more, last_key, last_id = cur.fetchone()
+    finally:
+        cur.close()
+
+    next_cursor = encode_cursor([last_key, last_id]) if has_more else None
+
+    return '{"events":' + events_json + ',"next_cursor":' + dumps(next_cursor) + '}'
\ No newline at end of file
@@ -0,0 +1,64 @@
+# Копия backend/shared/session_tokens.py: правьте оригинал и запускайте python backend/shared/sync.py
+'''Подписанные токены сессии: выдаёт auth, проверяют все функции без обращения к базе
+
+Формат: v1.<kid>.<claims в base64url>.<HMAC-SHA256 в base64url>. Ключи задаются в AUTH_TOKEN_KEYS
+как kid:secret через запятую; первым подписываются новые токены, остальные нужны для ротации.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', str(30 * 24 * 3600)))
+
+def load_token_keys() -> dict:
+    # Ключ не выводится ни из чего другого: без AUTH_TOKEN_KEYS выдача и проверка токенов отвечают 500.
+    # Для локальной разработки ключ задаётся явно, например AUTH_TOKEN_KEYS=dev:<любая строка>
+    keys = {}
+    for item in os.environ.get('AUTH_TOKEN_KEYS', '').split(','):
+        kid, _, secret = item.strip().partition(':')
+        if kid and secret:
+            keys[kid] = secret.encode('utf-8')
+    if not keys:
+        print('AUTH_TOKEN_KEYS не задан: выдача и проверка токенов сессии недоступны')
+    return keys
+
+TOKEN_KEYS = load_token_keys()
+
+def require_token_keys() -> dict:
+    if not TOKEN_KEYS:
+        raise RuntimeError('Не заданы ключи подписи токенов AUTH_TOKEN_KEYS')
+    return TOKEN_KEYS
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode((data + '=' * (-len(data) % 4)).encode('ascii'))
+
+def verify_session_token(token: str) -> Optional[dict]:
+    try:
+        version, kid, payload, signature = token.split('.')
+        secret = require_token_keys().get(kid)
+        if version != 'v1' or secret is None:
+            return None
+        expected = hmac.new(secret, f'{version}.{kid}.{payload}'.encode('ascii'), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def issue_session_token(user: dict) -> str:
+    kid, secret = next(iter(require_token_keys().items()))
+    now = int(time.time())
+    claims = {'sub': user['id'], 'email': user.get('email'), 'iat': now, 'exp': now + AUTH_TOKEN_TTL}
+    signing_input = f"v1.{kid}.{b64url_encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))}"
+    signature = hmac.new(secret, signing_input.encode('ascii'), hashlib.sha256).digest()
+    return f'{signing_input}.{b64url_encode(signature)}'
@@ -0,0 +1,109 @@
+# Копия backend/shared/db_pool.py: правьте оригинал и запускайте python backend/shared/sync.py
+'''Пул соединений PostgreSQL, общий для функций events, payment и auth'''
+import os
+import threading
+import time
+from typing import Optional
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '5'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+
+class ConnectionPool:
+    '''Пул соединений, живущий между тёплыми вызовами функции'''
+
+    def __init__(self, dsn: Optional[str], max_size: int, idle_timeout: float, healthcheck_interval: float, cursor_factory=None):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.cursor_factory = cursor_factory
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0}
+
+    @classmethod
+    def from_env(cls, cursor_factory=None) -> 'ConnectionPool':
+        return cls(os.environ.get('DATABASE_URL'), DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL, cursor_factory)
+
+    def getconn(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    if self._in_use >= self.max_size:
+                        raise psycopg2.pool.PoolError('connection pool exhausted')
+                    self._in_use += 1
+                    self._stats['misses'] += 1
+                    break
+                conn, released_at = self._idle.pop()
+                self._in_use += 1
+            idle_for = time.monotonic() - released_at
+            if idle_for > self.idle_timeout:
+                self._discard(conn, 'expired')
+                continue
+            if (conn.closed or idle_for > self.healthcheck_interval) and not self._is_healthy(conn):
+                self._discard(conn, 'stale')
+                continue
+            with self._lock:
+                self._stats['hits'] += 1
+            return conn
+        try:
+            return psycopg2.connect(self.dsn, cursor_factory=self.cursor_factory)
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+            raise
+
+    def putconn(self, conn) -> None:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._lock:
+            self._in_use -= 1
+            if not conn.closed and len(self._idle) < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        if not conn.closed:
+            conn.close()
+
+    def closeall(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            checkouts = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+                'hit_rate': round(self._stats['hits'] / checkouts, 4) if checkouts else None
+            }
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn, reason: str) -> None:
+        with self._lock:
+            self._in_use -= 1
+            self._stats[reason] += 1
+        if not conn.closed:
+            conn.close()
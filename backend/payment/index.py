@@ -1,16 +1,166 @@
 import json
 import os
+import base64
 import uuid
 import hashlib
-from datetime import datetime
+import hmac
+import select
+import threading
+import time
+from typing import Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db_pool import ConnectionPool
+from session_tokens import verify_session_token
+from runtime import Instrumentation, TimingCursorMixin, compress_response, dumps, get_header, is_admin_request, phase, sql_isoformat
+
+METRICS_ACTIONS = ('stats', 'metrics', 'slow_queries', 'create_payment', 'check_payment', 'wait_payment', 'payment_webhook', 'get_user_registrations')
+instrumentation = Instrumentation('payment', METRICS_ACTIONS)
+LISTING_SQL_JSON = os.environ.get('LISTING_SQL_JSON') == '1'
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED') == '1'
+REGISTRATION_HOLD_SECONDS = int(os.environ.get('REGISTRATION_HOLD_SECONDS', '900'))
+SBP_WEBHOOK_SECRET = os.environ.get('SBP_WEBHOOK_SECRET', '')
+PAYMENT_WAIT_MAX_SECONDS = float(os.environ.get('PAYMENT_WAIT_MAX_SECONDS', '25'))
+PAYMENT_WAIT_MAX_WAITERS = int(os.environ.get('PAYMENT_WAIT_MAX_WAITERS', '100'))
+# Страховка от пропущенного уведомления: статус перечитывается не реже этого интервала
+PAYMENT_WAIT_RECHECK_SECONDS = float(os.environ.get('PAYMENT_WAIT_RECHECK_SECONDS', '5'))
+PAYMENT_LISTENER_RECONNECT_SECONDS = float(os.environ.get('PAYMENT_LISTENER_RECONNECT_SECONDS', '1'))
+PAYMENT_NOTIFY_CHANNEL = 'payment_status'
+
+class TimedCursor(TimingCursorMixin, psycopg2.extensions.cursor):
+    instrumentation = instrumentation
+
+class TimedRealDictCursor(TimingCursorMixin, RealDictCursor):
+    instrumentation = instrumentation
+
+db_pool = ConnectionPool.from_env(cursor_factory=TimedCursor)
+instrumentation.pool = db_pool
 
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    with phase('db_connect'):
+        return db_pool.getconn()
+
+def release_db_connection(conn) -> None:
+    db_pool.putconn(conn)
+
+class PaymentWaitBusy(Exception):
+    pass
+
+class PaymentListener:
+    '''Одно соединение LISTEN на процесс: поток читает уведомления и будит ожидающих по registration_id'''
+
+    def __init__(self, dsn: Optional[str], channel: str, max_waiters: int):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_waiters = max_waiters
+        self._waiters = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._stats = {'notifications': 0, 'reconnects': 0, 'rejected': 0}
+
+    def subscribe(self, key: str, callback) -> None:
+        with self._lock:
+            if self._count >= self.max_waiters:
+                self._stats['rejected'] += 1
+                raise PaymentWaitBusy()
+            self._waiters.setdefault(key, set()).add(callback)
+            self._count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='payment-listener', daemon=True)
+                self._thread.start()
+        # Статус читается после подписки: если соединение ещё не поднялось, выручит перечитывание по таймеру
+        self._ready.wait(PAYMENT_WAIT_RECHECK_SECONDS)
+
+    def unsubscribe(self, key: str, callback) -> None:
+        with self._lock:
+            callbacks = self._waiters.get(key)
+            if callbacks is None or callback not in callbacks:
+                return
+            callbacks.discard(callback)
+            self._count -= 1
+            if not callbacks:
+                del self._waiters[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'waiters': self._count, 'max_waiters': self.max_waiters, 'connected': self._ready.is_set()}
 
+    def _wake(self, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                callbacks = [callback for group in self._waiters.values() for callback in group]
+            else:
+                callbacks = list(self._waiters.get(key, ()))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Ошибка пробуждения ожидающего оплату: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self._ready.set()
+                # Пока соединения не было, уведомления могли потеряться: все ожидающие перечитывают статус
+                self._wake()
+                while True:
+                    if select.select([conn], [], [], PAYMENT_WAIT_RECHECK_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    notifies = list(conn.notifies)
+                    del conn.notifies[:]
+                    with self._lock:
+                        self._stats['notifications'] += len(notifies)
+                    for notify in notifies:
+                        self._wake(notify.payload)
+            except (psycopg2.Error, OSError) as e:
+                print(f"Соединение LISTEN {self.channel} потеряно: {str(e)}")
+            finally:
+                self._ready.clear()
+                if conn is not None and not conn.closed:
+                    conn.close()
+            with self._lock:
+                self._stats['reconnects'] += 1
+            self._wake()
+            time.sleep(PAYMENT_LISTENER_RECONNECT_SECONDS)
+
+payment_listener = PaymentListener(os.environ.get('DATABASE_URL'), PAYMENT_NOTIFY_CHANNEL, PAYMENT_WAIT_MAX_WAITERS)
+
+def authenticate(event: dict) -> tuple:
+    token = get_header(event, 'X-Auth-Token')
+    if not token:
+        if AUTH_REQUIRED:
+            return None, {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Требуется авторизация'}),
+                'isBase64Encoded': False
+            }
+        return None, None
+
+    claims = verify_session_token(token)
+    if claims is None:
+        return None, {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недействительный токен'}),
+            'isBase64Encoded': False
+        }
+    return claims, None
+
+@instrumentation.instrumented
 def handler(event: dict, context) -> dict:
     '''API для обработки платежей через СБП за регистрацию на мероприятия'''
+    return compress_response(event, route_request(event))
+
+def route_request(event: dict) -> dict:
     method = event.get('httpMethod', 'POST')
     
     if method == 'OPTIONS':
@@ -19,20 +169,46 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Signature'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if (event.get('queryStringParameters') or {}).get('action') == 'metrics':
+        instrumentation.label_request('metrics')
+        return instrumentation.metrics_response(event)
+    
     try:
-        body = json.loads(event.get('body', '{}'))
+        raw_body = event.get('body') or '{}'
+        if event.get('isBase64Encoded'):
+            raw_body = base64.b64decode(raw_body).decode('utf-8')
+        body = json.loads(raw_body)
         action = body.get('action')
+        instrumentation.label_request(action)
+        
+        if action == 'payment_webhook':
+            return payment_webhook(event, raw_body, body)
         
-        if action == 'create_payment':
+        if action in ('create_payment', 'get_user_registrations'):
+            claims, error = authenticate(event)
+            if error:
+                return error
+            if claims:
+                body['user_id'] = claims['sub']
+        
+        if action == 'stats':
+            return get_stats(event)
+        elif action == 'metrics':
+            return instrumentation.metrics_response(event)
+        elif action == 'slow_queries':
+            return instrumentation.slow_queries_response(event)
+        elif action == 'create_payment':
             return create_payment(body)
         elif action == 'check_payment':
             return check_payment(body)
+        elif action == 'wait_payment':
+            return wait_payment(body)
         elif action == 'get_user_registrations':
             return get_user_registrations(body)
         else:
@@ -66,46 +242,97 @@ def create_payment(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
-        cur.execute("""
-            SELECT id, payment_status FROM registrations 
-            WHERE user_id = %s AND event_id = %s
-        """, (user_id, event_id))
-        
-        existing = cur.fetchone()
+        sbp_url = f"https://qr.nspk.ru/proverkacheka/v1/api/merchant/qr?amount={event_price}&purpose={event_title}"
         
-        if existing:
-            if existing['payment_status'] == 'paid':
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Вы уже зарегистрированы на это мероприятие'}),
-                    'isBase64Encoded': False
-                }
-            else:
-                registration_id = existing['id']
-        else:
-            payment_id = str(uuid.uuid4())
-            
+        params = {
+            'user_id': user_id,
+            'event_id': event_id,
+            'payment_id': str(uuid.uuid4()),
+            'price': event_price,
+            'payment_url': sbp_url,
+            'hold_seconds': REGISTRATION_HOLD_SECONDS
+        }
+        # Одна инструкция вместо вставки, блокировки, продления и захвата места по отдельности. Блокировки берутся
+        # в том же порядке, что у вебхука и воркера: сначала бронь, потом строка мероприятия. Место проверяется
+        # и занимается одним UPDATE, а бронь создаётся или возобновляется, только если место досталось или уже
+        # было за ней; мероприятия вне таблицы events места не ограничивают.
+        for _ in range(2):
             cur.execute("""
-                INSERT INTO registrations (user_id, event_id, payment_id, payment_status, payment_amount, event_price)
-                VALUES (%s, %s, %s, 'pending', %s, %s)
-                RETURNING id
-            """, (user_id, event_id, payment_id, event_price, event_price))
-            
-            registration_id = cur.fetchone()['id']
+                WITH existing AS (
+                    SELECT id, payment_status FROM registrations
+                    WHERE user_id = %(user_id)s AND event_id = %(event_id)s
+                    FOR UPDATE
+                ),
+                seat AS (
+                    UPDATE events SET seats_taken = seats_taken + 1
+                    WHERE id = %(event_id)s
+                      AND NOT EXISTS (SELECT 1 FROM existing WHERE payment_status IN ('pending', 'paid', 'refund_required'))
+                      AND (max_participants IS NULL OR seats_taken < max_participants)
+                    RETURNING id
+                ),
+                admitted AS (
+                    SELECT NOT EXISTS (SELECT 1 FROM existing WHERE payment_status IN ('paid', 'refund_required'))
+                       AND (EXISTS (SELECT 1 FROM existing WHERE payment_status = 'pending')
+                            OR EXISTS (SELECT 1 FROM seat)
+                            OR NOT EXISTS (SELECT 1 FROM events WHERE id = %(event_id)s)) AS ok
+                ),
+                created AS (
+                    INSERT INTO registrations (user_id, event_id, payment_id, payment_status, payment_amount, event_price, payment_url, hold_expires_at)
+                    SELECT %(user_id)s, %(event_id)s, %(payment_id)s, 'pending', %(price)s, %(price)s, %(payment_url)s,
+                           NOW() + make_interval(secs => %(hold_seconds)s)
+                    WHERE NOT EXISTS (SELECT 1 FROM existing) AND (SELECT ok FROM admitted)
+                    ON CONFLICT (user_id, event_id) DO NOTHING
+                    RETURNING id
+                ),
+                resumed AS (
+                    UPDATE registrations r
+                    SET payment_url = %(payment_url)s, payment_status = 'pending',
+                        hold_expires_at = NOW() + make_interval(secs => %(hold_seconds)s)
+                    FROM existing x
+                    WHERE r.id = x.id AND (SELECT ok FROM admitted)
+                    RETURNING r.id
+                )
+                SELECT COALESCE((SELECT id FROM created), (SELECT id FROM resumed)) AS id,
+                       (SELECT payment_status FROM existing) AS previous_status,
+                       EXISTS (SELECT 1 FROM seat) AS seat_taken
+            """, params)
+            registration = cur.fetchone()
+            # Место занято, а строки нет: параллельный повтор того же пользователя вставил бронь после начала
+            # инструкции. Откат возвращает место, второй проход уже видит бронь и продлевает её
+            if registration['id'] is None and registration['seat_taken']:
+                conn.rollback()
+                continue
             conn.commit()
+            break
         
-        sbp_url = f"https://qr.nspk.ru/proverkacheka/v1/api/merchant/qr?amount={event_price}&purpose={event_title}"
+        if registration['previous_status'] == 'paid':
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Вы уже зарегистрированы на это мероприятие'}),
+                'isBase64Encoded': False
+            }
         
-        cur.execute("""
-            UPDATE registrations 
-            SET payment_url = %s 
-            WHERE id = %s
-        """, (sbp_url, registration_id))
-        conn.commit()
+        if registration['previous_status'] == 'refund_required':
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Оплата пришла после снятия брони, места не осталось; деньги будут возвращены'}),
+                'isBase64Encoded': False
+            }
+        
+        if registration['id'] is None:
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Свободных мест на мероприятие не осталось'}),
+                'isBase64Encoded': False
+            }
+        
+        registration_id = registration['id']
         
         return {
             'statusCode': 200,
@@ -114,6 +341,7 @@ def create_payment(body: dict) -> dict:
                 'registration_id': registration_id,
                 'payment_url': sbp_url,
                 'amount': event_price,
+                'hold_seconds': REGISTRATION_HOLD_SECONDS,
                 'message': f'Оплатите {event_price} ₽ через СБП для завершения регистрации'
             }),
             'isBase64Encoded': False
@@ -121,7 +349,7 @@ def create_payment(body: dict) -> dict:
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def check_payment(body: dict) -> dict:
     registration_id = body.get('registration_id')
@@ -135,7 +363,7 @@ def check_payment(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
         cur.execute("""
@@ -155,16 +383,224 @@ def check_payment(body: dict) -> dict:
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
+            'body': dumps({
                 'status': registration['payment_status'],
-                'paid_at': registration['paid_at'].isoformat() if registration['paid_at'] else None
+                'paid_at': registration['paid_at']
             }),
             'isBase64Encoded': False
         }
     
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+
+def verify_webhook_signature(event: dict, raw_body: str) -> bool:
+    signature = get_header(event, 'X-Signature')
+    if not SBP_WEBHOOK_SECRET or not signature:
+        return False
+    expected = hmac.new(SBP_WEBHOOK_SECRET.encode('utf-8'), raw_body.encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+def payment_webhook(event: dict, raw_body: str, body: dict) -> dict:
+    if not verify_webhook_signature(event, raw_body):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неверная подпись уведомления'}),
+            'isBase64Encoded': False
+        }
+    
+    payment_id = body.get('payment_id')
+    status = body.get('status')
+    
+    if not payment_id or not status:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Укажите payment_id и status'}),
+            'isBase64Encoded': False
+        }
+    
+    if status != 'paid':
+        # Неоплаченную бронь снимет воркер по истечении hold_expires_at
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'result': 'ignored'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+    
+    try:
+        # Повторная доставка ничего не меняет: обновляются только неоплаченные строки. Если воркер успел снять
+        # бронь до прихода оплаты, место занимается снова, но только пока оно свободно; иначе деньги получены
+        # без места, и бронь помечается refund_required для возврата или ручного разбора
+        cur.execute("""
+            WITH target AS (
+                SELECT id, event_id, payment_status FROM registrations
+                WHERE payment_id = %(payment_id)s
+                FOR UPDATE
+            ),
+            seat AS (
+                UPDATE events e SET seats_taken = e.seats_taken + 1
+                FROM target t
+                WHERE e.id = t.event_id AND t.payment_status NOT IN ('pending', 'paid', 'refund_required')
+                  AND (e.max_participants IS NULL OR e.seats_taken < e.max_participants)
+                RETURNING t.id
+            ),
+            settled AS (
+                UPDATE registrations r
+                SET payment_status = CASE
+                        WHEN t.payment_status = 'pending'
+                          OR EXISTS (SELECT 1 FROM seat WHERE seat.id = t.id)
+                          OR NOT EXISTS (SELECT 1 FROM events WHERE id = t.event_id) THEN 'paid'
+                        ELSE 'refund_required'
+                    END,
+                    paid_at = CURRENT_TIMESTAMP, hold_expires_at = NULL
+                FROM target t
+                WHERE r.id = t.id AND t.payment_status NOT IN ('paid', 'refund_required')
+                RETURNING r.id, r.payment_status
+            )
+            SELECT (SELECT COUNT(*) FROM target) AS matched,
+                   (SELECT COALESCE(array_agg(id), '{}') FROM settled) AS settled_ids,
+                   (SELECT COALESCE(array_agg(id), '{}') FROM settled WHERE payment_status = 'refund_required') AS refund_ids
+        """, {'payment_id': payment_id})
+        registrations = cur.fetchone()
+        
+        # NOTIFY доставляется слушателям только после фиксации транзакции
+        for registration_id in registrations['settled_ids']:
+            cur.execute("SELECT pg_notify(%s, %s)", (PAYMENT_NOTIFY_CHANNEL, str(registration_id)))
+        
+        cur.execute("""
+            WITH target AS (
+                SELECT id FROM event_publications WHERE payment_id = %(payment_id)s
+            ),
+            publication AS (
+                UPDATE event_publications
+                SET payment_status = 'paid', paid_at = CURRENT_TIMESTAMP
+                WHERE payment_id = %(payment_id)s AND payment_status <> 'paid'
+                RETURNING event_id
+            ),
+            published AS (
+                UPDATE events SET status = 'published', updated_at = CURRENT_TIMESTAMP
+                FROM publication
+                WHERE events.id = publication.event_id
+                RETURNING events.id
+            )
+            SELECT (SELECT COUNT(*) FROM target) AS matched,
+                   (SELECT COUNT(*) FROM published) AS published
+        """, {'payment_id': payment_id})
+        publications = cur.fetchone()
+        conn.commit()
+        
+        if not registrations['matched'] and not publications['matched']:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Платёж не найден'}),
+                'isBase64Encoded': False
+            }
+        
+        if registrations['refund_ids']:
+            print(json.dumps({'refund_required': {'payment_id': payment_id, 'registration_ids': registrations['refund_ids']}}))
+            result = 'refund_required'
+        elif registrations['settled_ids'] or publications['published']:
+            result = 'processed'
+        else:
+            result = 'already_processed'
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'result': result}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def parse_wait_timeout(body: dict) -> float:
+    try:
+        return min(max(float(body.get('timeout', PAYMENT_WAIT_MAX_SECONDS)), 0), PAYMENT_WAIT_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return PAYMENT_WAIT_MAX_SECONDS
+
+def wait_busy_response() -> dict:
+    return {
+        'statusCode': 503,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': '1'},
+        'body': json.dumps({'error': 'Слишком много ожидающих оплату, проверьте статус позже'}),
+        'isBase64Encoded': False
+    }
+
+def read_payment_status(registration_id) -> Optional[dict]:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+    
+    try:
+        cur.execute("""
+            SELECT payment_status, paid_at FROM registrations WHERE id = %s
+        """, (registration_id,))
+        registration = cur.fetchone()
+        conn.commit()
+        return registration
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def wait_payment(body: dict) -> dict:
+    registration_id = body.get('registration_id')
+    
+    if not registration_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Укажите registration_id'}),
+            'isBase64Encoded': False
+        }
+    
+    deadline = time.monotonic() + parse_wait_timeout(body)
+    woken = threading.Event()
+    
+    # Соединение из пула берётся только на короткое чтение статуса, уведомления слушает payment_listener
+    try:
+        payment_listener.subscribe(str(registration_id), woken.set)
+    except PaymentWaitBusy:
+        return wait_busy_response()
+    
+    try:
+        while True:
+            woken.clear()
+            registration = read_payment_status(registration_id)
+            
+            if not registration:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Регистрация не найдена'}),
+                    'isBase64Encoded': False
+                }
+            
+            remaining = deadline - time.monotonic()
+            if registration['payment_status'] != 'pending' or remaining <= 0:
+                break
+            woken.wait(min(remaining, PAYMENT_WAIT_RECHECK_SECONDS))
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({
+                'status': registration['payment_status'],
+                'paid_at': registration['paid_at']
+            }),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        payment_listener.unsubscribe(str(registration_id), woken.set)
 
 def get_user_registrations(body: dict) -> dict:
     user_id = body.get('user_id')
@@ -178,36 +614,61 @@ def get_user_registrations(body: dict) -> dict:
         }
     
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(cursor_factory=TimedRealDictCursor)
     
     try:
+        if LISTING_SQL_JSON:
+            cur.execute(f"""
+                SELECT '[' || COALESCE(string_agg(r.doc::text, ',' ORDER BY r.created_at DESC, r.id DESC), '') || ']' AS registrations
+                FROM (
+                    SELECT id, created_at, (SELECT row_to_json(doc) FROM (SELECT
+                               id, event_id, payment_status AS status, payment_amount AS amount,
+                               {sql_isoformat('created_at')} AS created_at, {sql_isoformat('paid_at')} AS paid_at
+                           ) doc) AS doc
+                    FROM registrations 
+                    WHERE user_id = %s
+                ) r
+            """, (user_id,))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': '{"registrations":' + cur.fetchone()['registrations'] + '}',
+                'isBase64Encoded': False
+            }
+        
         cur.execute("""
-            SELECT id, event_id, payment_status, payment_amount, created_at, paid_at
+            SELECT id, event_id, payment_status AS status, payment_amount AS amount, created_at, paid_at
             FROM registrations 
             WHERE user_id = %s
-            ORDER BY created_at DESC
+            ORDER BY created_at DESC, id DESC
         """, (user_id,))
         
         registrations = cur.fetchall()
         
-        result = []
-        for reg in registrations:
-            result.append({
-                'id': reg['id'],
-                'event_id': reg['event_id'],
-                'status': reg['payment_status'],
-                'amount': reg['payment_amount'],
-                'created_at': reg['created_at'].isoformat() if reg['created_at'] else None,
-                'paid_at': reg['paid_at'].isoformat() if reg['paid_at'] else None
-            })
-        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'registrations': result}),
+            'body': dumps({'registrations': registrations}),
             'isBase64Encoded': False
         }
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
+
+def get_stats(event: dict) -> dict:
+    if not is_admin_request(event):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'db_pool': db_pool.stats(), 'payment_listener': payment_listener.stats()}),
+        'isBase64Encoded': False
+    }
\ No newline at end of file
@@ -0,0 +1,217 @@
+'''ASGI-обёртка, запускающая функции events, payment и auth как обычный многопроцессный сервис
+
+Запуск: python backend/server/app.py --workers 4 --port 8000
+или через gunicorn: gunicorn -k uvicorn.workers.UvicornWorker -w 4 --chdir backend/server app:app
+'''
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from async_db import AsyncDataAccess, asyncpg
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ('events', 'payment', 'auth')
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', '16'))
+SERVER_MAX_BODY_BYTES = int(os.environ.get('SERVER_MAX_BODY_BYTES', str(32 * 1024 * 1024)))
+SERVER_TRUST_FORWARDED = os.environ.get('SERVER_TRUST_FORWARDED') == '1'
+SERVER_ASYNC_DB = os.environ.get('SERVER_ASYNC_DB', '1') == '1'
+SERVER_ASYNC_POOL_MIN_SIZE = int(os.environ.get('SERVER_ASYNC_POOL_MIN_SIZE', '2'))
+SERVER_ASYNC_POOL_MAX_SIZE = int(os.environ.get('SERVER_ASYNC_POOL_MAX_SIZE', '20'))
+SERVER_ASYNC_STATEMENT_CACHE = int(os.environ.get('SERVER_ASYNC_STATEMENT_CACHE', '100'))
+# gunicorn передаёт число процессов в WEB_CONCURRENCY, запуск через __main__ — в SERVER_WORKERS
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+# Соединений к базе на все процессы сервиса; до max_connections оставьте запас под воркер, миграции и psql
+DB_CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', '80'))
+
+def size_connection_pools(budget: int, workers: int, threads: int, async_max_size: int) -> tuple:
+    '''Делит бюджет соединений между процессами и пулами внутри процесса
+
+    Процесс держит три синхронных пула (events, payment, auth) по DB_POOL_MAX_SIZE — простаивающие соединения
+    остаются в каждом, — пул asyncpg и одно соединение LISTEN у payment:
+
+        workers × (3 × DB_POOL_MAX_SIZE + SERVER_ASYNC_POOL_MAX_SIZE + 1) ≤ DB_CONNECTION_BUDGET
+
+    asyncpg получает не больше четверти доли процесса. Поток обработчика держит одно соединение за раз,
+    поэтому пул функции равен числу потоков, а потоков не больше, чем пул, который помещается в бюджет.
+    '''
+    per_worker = budget // workers
+    async_max_size = min(async_max_size, max(per_worker // 4, 1)) if async_max_size else 0
+    pool_size = max((per_worker - 1 - async_max_size) // 3, 1)
+    return min(threads, pool_size), async_max_size
+
+SERVER_THREADS, SERVER_ASYNC_POOL_MAX_SIZE = size_connection_pools(
+    DB_CONNECTION_BUDGET, SERVER_WORKERS, SERVER_THREADS,
+    SERVER_ASYNC_POOL_MAX_SIZE if SERVER_ASYNC_DB and asyncpg is not None else 0
+)
+SERVER_ASYNC_POOL_MIN_SIZE = min(SERVER_ASYNC_POOL_MIN_SIZE, SERVER_ASYNC_POOL_MAX_SIZE)
+
+# Обработчики синхронные и держат соединение пула на время запроса, поэтому пул не меньше числа потоков
+os.environ.setdefault('DB_POOL_MAX_SIZE', str(SERVER_THREADS))
+# Синхронный wait_payment держит поток всё время ожидания; без асинхронного пути ожидающим достаётся половина потоков
+if not (SERVER_ASYNC_DB and asyncpg is not None):
+    os.environ.setdefault('PAYMENT_WAIT_MAX_WAITERS', str(max(SERVER_THREADS // 2, 1)))
+
+def load_function(name: str):
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    # Копии общих модулей (db_pool.py и др.) лежат рядом с index.py и одинаковы во всех функциях
+    if os.path.dirname(path) not in sys.path:
+        sys.path.append(os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(f'function_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class FunctionApp:
+    '''ASGI-приложение: путь /<функция>/... превращается в event и передаётся её handler'''
+
+    def __init__(self):
+        self.modules = {}
+        self.executor = None
+        self.async_db = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self) -> None:
+        # Холодный старт оплачивается один раз на процесс, а не на каждый экземпляр функции
+        self.modules = {name: load_function(name) for name in FUNCTIONS}
+        self.executor = ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix='handler')
+        print(json.dumps({'server_pools': {
+            'workers': SERVER_WORKERS, 'budget': DB_CONNECTION_BUDGET, 'threads': SERVER_THREADS,
+            'db_pool_max_size': int(os.environ['DB_POOL_MAX_SIZE']), 'async_pool_max_size': SERVER_ASYNC_POOL_MAX_SIZE
+        }}))
+        if SERVER_ASYNC_DB and SERVER_ASYNC_POOL_MAX_SIZE and os.environ.get('DATABASE_URL'):
+            self.async_db = await AsyncDataAccess.create(
+                self.modules, os.environ['DATABASE_URL'], self.executor,
+                SERVER_ASYNC_POOL_MIN_SIZE, SERVER_ASYNC_POOL_MAX_SIZE, SERVER_ASYNC_STATEMENT_CACHE
+            )
+
+    async def shutdown(self) -> None:
+        # Сервер уже дождался активных запросов, остаётся закрыть потоки и соединения пулов
+        if self.async_db is not None:
+            await self.async_db.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for module in self.modules.values():
+            module.db_pool.closeall()
+
+    async def http(self, scope, receive, send):
+        name = scope['path'].strip('/').split('/', 1)[0]
+
+        if name == 'healthz':
+            stats = {name: module.db_pool.stats() for name, module in self.modules.items()}
+            if self.async_db is not None:
+                stats['async_pool'] = {'size': self.async_db.pool.get_size(), 'idle': self.async_db.pool.get_idle_size()}
+            await self.respond(send, 200, {'Content-Type': 'application/json'}, json.dumps(stats).encode('utf-8'))
+            return
+
+        module = self.modules.get(name)
+        if module is None:
+            await self.respond(send, 404, {'Content-Type': 'application/json'}, b'{"error": "Not found"}')
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.extend(message.get('body', b''))
+            if len(body) > SERVER_MAX_BODY_BYTES:
+                await self.respond(send, 413, {'Content-Type': 'application/json'}, b'{"error": "Request body too large"}')
+                return
+            if not message.get('more_body'):
+                break
+
+        event = self.build_event(scope, bytes(body))
+        response = None
+        if self.async_db is not None:
+            response = await self.async_db.handle(name, event)
+        if response is None:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self.executor, module.handler, event, None)
+
+        payload = response.get('body') or ''
+        payload = base64.b64decode(payload) if response.get('isBase64Encoded') else payload.encode('utf-8')
+        await self.respond(send, response['statusCode'], response.get('headers') or {}, payload)
+
+    def build_event(self, scope, body: bytes) -> dict:
+        headers = {}
+        for key, value in scope['headers']:
+            key = key.decode('latin-1')
+            headers[key] = f"{headers[key]}, {value.decode('latin-1')}" if key in headers else value.decode('latin-1')
+
+        source_ip = scope['client'][0] if scope.get('client') else None
+        if SERVER_TRUST_FORWARDED and headers.get('x-forwarded-for'):
+            source_ip = headers['x-forwarded-for'].split(',')[0].strip()
+
+        try:
+            text, is_base64 = body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            text, is_base64 = base64.b64encode(body).decode('ascii'), True
+
+        return {
+            'httpMethod': scope['method'],
+            'path': scope['path'],
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(scope['query_string'].decode('latin-1'))) or None,
+            'body': text,
+            'isBase64Encoded': is_base64,
+            'requestContext': {'identity': {'sourceIp': source_ip}}
+        }
+
+    async def respond(self, send, status: int, headers: dict, payload: bytes) -> None:
+        raw_headers = [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()
+                       if key.lower() != 'content-length']
+        raw_headers.append((b'content-length', str(len(payload)).encode('ascii')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+app = FunctionApp()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Запуск функций events, payment и auth как HTTP-сервиса')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--graceful-timeout', type=int, default=30, help='Секунд на завершение активных запросов')
+    args = parser.parse_args()
+    # Процессы uvicorn импортируют app заново и делят бюджет соединений по этому числу
+    os.environ['SERVER_WORKERS'] = str(args.workers)
+
+    uvicorn.run(
+        'app:app',
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan='on',
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=SERVER_TRUST_FORWARDED
+    )
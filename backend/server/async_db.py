@@ -0,0 +1,272 @@
+'''Асинхронный доступ к базе через asyncpg для самых частых запросов: лента, статус и ожидание оплаты, регистрации, вход'''
+import asyncio
+import json
+import re
+import time
+from typing import Optional
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+PLACEHOLDER = re.compile(r'%s|%%')
+
+def to_asyncpg(sql: str) -> str:
+    # Запросы функций написаны под psycopg2: %s превращается в $1..$n, %% — в %
+    counter = iter(range(1, 10000))
+    return PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f'${next(counter)}', sql)
+
+def json_error(status: int, message: str, headers: Optional[dict] = None) -> dict:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+class AsyncDataAccess:
+    '''Пул asyncpg на процесс: один поток событий обслуживает сотни одновременных запросов на чтение'''
+
+    def __init__(self, modules: dict, pool, executor):
+        self.modules = modules
+        self.pool = pool
+        self.executor = executor
+        self.routes = {
+            ('events', 'list_events'): self.list_events,
+            ('payment', 'check_payment'): self.check_payment,
+            ('payment', 'wait_payment'): self.wait_payment,
+            ('payment', 'get_user_registrations'): self.get_user_registrations,
+            ('auth', 'login'): self.login
+        }
+
+    @classmethod
+    async def create(cls, modules: dict, dsn: str, executor, min_size: int, max_size: int, statement_cache_size: int):
+        # Кэш подготовленных запросов позволяет asyncpg отправлять Bind/Execute/Sync одним пакетом без Parse;
+        # за pgbouncer в режиме транзакций его нужно выключить
+        pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size,
+                                         statement_cache_size=statement_cache_size)
+        return cls(modules, pool, executor)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def handle(self, name: str, event: dict) -> Optional[dict]:
+        action, body = self.resolve_action(name, event)
+        route = self.routes.get((name, action))
+        if route is None:
+            return None
+
+        module = self.modules[name]
+        started = time.perf_counter()
+        with module.instrumentation.request() as timer:
+            module.instrumentation.label_request(action)
+            try:
+                response = await route(module, event, body)
+            except Exception as e:
+                response = json_error(500, str(e))
+            response = module.compress_response(event, response)
+        return module.instrumentation.finish_request(event, response, timer, time.perf_counter() - started)
+
+    def resolve_action(self, name: str, event: dict) -> tuple:
+        method = event.get('httpMethod')
+        if name == 'events' and method == 'GET':
+            if (event.get('queryStringParameters') or {}).get('action') == 'metrics':
+                return None, None
+            return 'list_events', None
+        if method != 'POST' or event.get('isBase64Encoded'):
+            return None, None
+        try:
+            body = json.loads(event.get('body') or '{}')
+        except ValueError:
+            return None, None
+        if not isinstance(body, dict):
+            return None, None
+        return body.get('action'), body
+
+    async def offload(self, local: bool, fn, *args):
+        # Кэш и ограничитель в памяти отвечают мгновенно, сетевые варианты (Redis) уходят в пул потоков
+        if local:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def hash(self, auth, fn, *args):
+        future = auth.hashing_pool.submit(fn, *args)
+        with auth.phase('hash'):
+            return await asyncio.wrap_future(future)
+
+    async def fetch(self, module, sql: str, *args) -> list:
+        with module.phase('db_connect'):
+            conn = await self.pool.acquire()
+        try:
+            with module.phase('query'):
+                rows = await conn.fetch(sql, *args)
+        finally:
+            await self.pool.release(conn)
+        module.instrumentation.record_query(len(rows))
+        return rows
+
+    async def execute(self, module, sql: str, *args) -> None:
+        with module.phase('db_connect'):
+            conn = await self.pool.acquire()
+        try:
+            with module.phase('query'):
+                await conn.execute(sql, *args)
+        finally:
+            await self.pool.release(conn)
+
+    async def list_events(self, events, event: dict, body) -> dict:
+        query_params = events.normalize_listing_params(event.get('queryStringParameters') or {})
+        cache_key = events.listing_cache_key(query_params)
+        cache_local = isinstance(events.listing_cache, events.MemoryCache)
+
+        if cache_key:
+            cached = await self.offload(cache_local, events.cached_listing_response, event, cache_key)
+            if cached is not None:
+                return cached
+
+        error, query = events.build_listing_query(query_params)
+        if error:
+            return error
+
+        versions = await self.fetch(events, 'SELECT version, changed_at FROM listing_version')
+        version, changed_at = tuple(versions[0]) if versions else (0, None)
+        headers = events.listing_headers(query_params, version, changed_at)
+        if events.is_not_modified(event, headers['ETag'], headers.get('Last-Modified')):
+            return events.not_modified_response(headers)
+
+        sql = events.events_select_sql(query['from_clause'], query['sort_key_column'], query['with_distance'])
+        rows = await self.fetch(events, to_asyncpg(sql), *query['params'])
+        rows = [tuple(row) for row in rows]
+        has_more = len(rows) > query['limit']
+        response = {
+            'statusCode': 200,
+            'headers': headers,
+            'body': events.events_page_body(rows[:query['limit']], has_more, query['with_distance']),
+            'isBase64Encoded': False
+        }
+        if cache_key:
+            await self.offload(cache_local, events.cache_listing_response, cache_key, response)
+        return response
+
+    async def check_payment(self, payment, event: dict, body: dict) -> dict:
+        try:
+            registration_id = int(body.get('registration_id'))
+        except (TypeError, ValueError):
+            return json_error(400, 'Укажите registration_id')
+
+        rows = await self.fetch(payment, 'SELECT payment_status, paid_at FROM registrations WHERE id = $1', registration_id)
+        if not rows:
+            return json_error(404, 'Регистрация не найдена')
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': payment.dumps({'status': rows[0]['payment_status'], 'paid_at': rows[0]['paid_at']}),
+            'isBase64Encoded': False
+        }
+
+    async def wait_payment(self, payment, event: dict, body: dict) -> dict:
+        try:
+            registration_id = int(body.get('registration_id'))
+        except (TypeError, ValueError):
+            return json_error(400, 'Укажите registration_id')
+
+        deadline = time.monotonic() + payment.parse_wait_timeout(body)
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake() -> None:
+            # Вызывается из потока payment_listener
+            loop.call_soon_threadsafe(woken.set)
+
+        # Ожидание не занимает ни поток, ни соединение: подписка общая с синхронным путём, статус читается из asyncpg
+        try:
+            await loop.run_in_executor(self.executor, payment.payment_listener.subscribe, str(registration_id), wake)
+        except payment.PaymentWaitBusy:
+            return payment.wait_busy_response()
+
+        try:
+            while True:
+                woken.clear()
+                rows = await self.fetch(payment, 'SELECT payment_status, paid_at FROM registrations WHERE id = $1', registration_id)
+                if not rows:
+                    return json_error(404, 'Регистрация не найдена')
+
+                remaining = deadline - time.monotonic()
+                if rows[0]['payment_status'] != 'pending' or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(woken.wait(), min(remaining, payment.PAYMENT_WAIT_RECHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            payment.payment_listener.unsubscribe(str(registration_id), wake)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': payment.dumps({'status': rows[0]['payment_status'], 'paid_at': rows[0]['paid_at']}),
+            'isBase64Encoded': False
+        }
+
+    async def get_user_registrations(self, payment, event: dict, body: dict) -> dict:
+        claims, error = payment.authenticate(event)
+        if error:
+            return error
+        if claims:
+            body['user_id'] = claims['sub']
+
+        try:
+            user_id = int(body.get('user_id'))
+        except (TypeError, ValueError):
+            return json_error(400, 'Укажите user_id')
+
+        rows = await self.fetch(payment, """
+            SELECT id, event_id, payment_status AS status, payment_amount AS amount, created_at, paid_at
+            FROM registrations
+            WHERE user_id = $1
+            ORDER BY created_at DESC, id DESC
+        """, user_id)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': payment.dumps({'registrations': [dict(row) for row in rows]}),
+            'isBase64Encoded': False
+        }
+
+    async def login(self, auth, event: dict, body: dict) -> dict:
+        limited = await self.offload(isinstance(auth.rate_limiter, auth.SlidingWindowLimiter),
+                                     auth.check_rate_limits, 'login', body, auth.get_client_ip(event))
+        if limited:
+            return limited
+
+        email = body.get('email')
+        password = body.get('password')
+        if not email or not password:
+            return json_error(400, 'Укажите email и пароль')
+
+        rows = await self.fetch(auth, """
+            SELECT id, email, password_hash, full_name, created_at
+            FROM t_p2283616_event_discovery_app.users WHERE email = $1
+        """, email)
+        if not rows or not rows[0]['password_hash']:
+            return auth.invalid_credentials_response()
+        user = dict(rows[0])
+
+        # PBKDF2 уходит прямо в пул хэширования auth: ни поток обработчика, ни поток событий не ждут
+        try:
+            if not await self.hash(auth, auth.check_password, user['password_hash'], password):
+                return auth.invalid_credentials_response()
+            if auth.password_needs_rehash(user['password_hash']):
+                new_hash = await self.hash(auth, auth.compute_password_hash, password)
+                await self.execute(auth, """
+                    UPDATE t_p2283616_event_discovery_app.users
+                    SET password_hash = $1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $2
+                """, new_hash, user['id'])
+        except auth.PasswordHashingBusy:
+            return json_error(503, 'Сервер перегружен, попробуйте позже', {'Retry-After': '1'})
+
+        return auth.login_response(user)
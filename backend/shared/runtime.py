@@ -0,0 +1,418 @@
+'''Общий код обработчиков: замеры фаз, метрики, журнал медленных запросов, сериализация и сжатие ответов'''
+import base64
+import contextlib
+import contextvars
+import functools
+import gzip
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Optional
+
+import psycopg2
+import psycopg2.extensions
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '200'))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '0.1'))
+SLOW_QUERY_BUFFER_SIZE = int(os.environ.get('SLOW_QUERY_BUFFER_SIZE', '100'))
+
+request_timer = contextvars.ContextVar('request_timer', default=None)
+
+class RequestTimer:
+    '''Длительности фаз и число строк одного запроса'''
+
+    def __init__(self):
+        self.action = None
+        self.phases = {}
+        self.queries = 0
+        self.rows = 0
+        self._active = set()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        # Вложенная фаза с тем же именем уже учтена внешней
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+@contextlib.contextmanager
+def phase(name: str):
+    timer = request_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+def record_query(rows: int) -> None:
+    timer = request_timer.get()
+    if timer is not None:
+        timer.queries += 1
+        timer.rows += rows
+
+class Histograms:
+    '''Гистограммы длительностей в формате Prometheus, накопленные за жизнь экземпляра'''
+
+    def __init__(self, buckets: tuple, function_name: str):
+        self.buckets = buckets
+        self.function_name = function_name
+        self._series = {}
+        self._requests = {}
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, action: str, status: int, timer: RequestTimer, total: float) -> None:
+        with self._lock:
+            for phase, seconds in list(timer.phases.items()) + [('total', total)]:
+                series = self._series.setdefault((action, phase), [[0] * len(self.buckets), 0.0, 0])
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        series[0][i] += 1
+                series[1] += seconds
+                series[2] += 1
+            self._requests[(action, status)] = self._requests.get((action, status), 0) + 1
+            self._rows[action] = self._rows.get(action, 0) + timer.rows
+
+    def render(self, pool_stats: Optional[dict] = None, counters: Optional[dict] = None) -> str:
+        labels = f'function="{self.function_name}"'
+        lines = [
+            '# HELP request_phase_seconds Длительность фаз обработки запроса',
+            '# TYPE request_phase_seconds histogram'
+        ]
+        with self._lock:
+            for (action, phase), (counts, total, count) in sorted(self._series.items()):
+                series_labels = f'{labels},action="{action}",phase="{phase}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'request_phase_seconds_bucket{{{series_labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'request_phase_seconds_bucket{{{series_labels},le="+Inf"}} {count}')
+                lines.append(f'request_phase_seconds_sum{{{series_labels}}} {total:.6f}')
+                lines.append(f'request_phase_seconds_count{{{series_labels}}} {count}')
+            lines += ['# HELP requests_total Число обработанных запросов', '# TYPE requests_total counter']
+            for (action, status), count in sorted(self._requests.items()):
+                lines.append(f'requests_total{{{labels},action="{action}",status="{status}"}} {count}')
+            lines += ['# HELP db_rows_total Число строк, полученных из базы', '# TYPE db_rows_total counter']
+            for action, count in sorted(self._rows.items()):
+                lines.append(f'db_rows_total{{{labels},action="{action}"}} {count}')
+        if pool_stats is not None:
+            lines += ['# HELP db_pool_connections Соединения пула', '# TYPE db_pool_connections gauge']
+            for state in ('idle', 'in_use'):
+                lines.append(f'db_pool_connections{{{labels},state="{state}"}} {pool_stats[state]}')
+        # Счётчики самой функции: {имя: (описание, [(метки, значение), ...])}
+        for name, (description, samples) in sorted((counters or {}).items()):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for sample_labels, value in samples:
+                extra = ''.join(f',{key}="{label}"' for key, label in sample_labels.items())
+                lines.append(f'{name}{{{labels}{extra}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+SQL_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(query: str) -> str:
+    query = SQL_STRING_LITERAL.sub('?', query)
+    query = SQL_NUMBER_LITERAL.sub('?', query)
+    return SQL_WHITESPACE.sub(' ', query).strip()
+
+def param_shape(value):
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+def params_shape(params):
+    # Сохраняются только типы параметров: значения могут содержать персональные данные
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: param_shape(value) for key, value in params.items()}
+    return [param_shape(value) for value in params]
+
+def is_explainable(sql: str) -> bool:
+    # EXPLAIN ANALYZE выполняет запрос повторно, поэтому допускаются только чистые SELECT
+    upper = sql.upper()
+    return upper.startswith('SELECT') and not any(
+        marker in upper for marker in ('FOR UPDATE', 'FOR SHARE', 'FOR NO KEY UPDATE', 'PG_NOTIFY', 'NEXTVAL')
+    )
+
+def explain_query(conn, query: str, params) -> Optional[list]:
+    savepoint = not conn.autocommit
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        with phase('explain'):
+            if savepoint:
+                cur.execute('SAVEPOINT slow_query_explain')
+            try:
+                cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, params)
+                plan = [row[0] for row in cur.fetchall()]
+            except psycopg2.Error as e:
+                if savepoint:
+                    cur.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                plan = [f'EXPLAIN failed: {e}'.strip()]
+            if savepoint:
+                cur.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    finally:
+        cur.close()
+
+def get_header(event: dict, name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def is_admin_request(event: dict) -> bool:
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    provided = get_header(event, 'X-Admin-Token')
+    return bool(admin_token and provided and hmac.compare_digest(admin_token, provided))
+
+def forbidden_response() -> dict:
+    return {
+        'statusCode': 403,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Доступ запрещён'}),
+        'isBase64Encoded': False
+    }
+
+class Instrumentation:
+    '''Метрики, журнал медленных запросов и Server-Timing одной функции'''
+
+    def __init__(self, function_name: str, actions: tuple):
+        self.function_name = function_name
+        self.actions = actions
+        # Пул создаётся позже курсора, который ссылается на этот объект; нужен только для метрик
+        self.pool = None
+        # Функция может отдать свои счётчики в /metrics: вызывается при каждом рендере, формат как у Histograms.render
+        self.counters = None
+        self.metrics = Histograms(METRICS_BUCKETS, function_name)
+        self.slow_queries = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+        self._slow_queries_lock = threading.Lock()
+
+    def record_query(self, rows: int) -> None:
+        # Для запросов в обход курсора psycopg2, например через asyncpg
+        record_query(rows)
+
+    def label_request(self, action) -> None:
+        timer = request_timer.get()
+        if timer is not None:
+            # Произвольные значения action из запроса не должны плодить серии метрик
+            timer.action = action if action in self.actions else 'unknown'
+
+    def record_slow_query(self, conn, query, params, duration: float, rows: int) -> None:
+        if duration * 1000 < SLOW_QUERY_THRESHOLD_MS:
+            return
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        if not isinstance(query, str):
+            return
+
+        sql = normalize_sql(query)
+        plan = None
+        if is_explainable(sql) and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+            plan = explain_query(conn, query, params)
+
+        timer = request_timer.get()
+        entry = {
+            'at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'function': self.function_name,
+            'action': timer.action if timer is not None else None,
+            'duration_ms': round(duration * 1000, 1),
+            'rows': rows,
+            'sql': sql,
+            'params': params_shape(params),
+            'plan': plan
+        }
+        with self._slow_queries_lock:
+            self.slow_queries.append(entry)
+        print(json.dumps({'slow_query': entry}, ensure_ascii=False))
+
+    def slow_queries_response(self, event: dict) -> dict:
+        if not is_admin_request(event):
+            return forbidden_response()
+
+        with self._slow_queries_lock:
+            entries = list(self.slow_queries)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+                'explain_sample_rate': SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+                'queries': entries[::-1]
+            }),
+            'isBase64Encoded': False
+        }
+
+    def metrics_response(self, event: dict) -> dict:
+        if not is_admin_request(event):
+            return forbidden_response()
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'text/plain; version=0.0.4', 'Access-Control-Allow-Origin': '*'},
+            'body': self.metrics.render(self.pool.stats() if self.pool is not None else None,
+                                        self.counters() if self.counters is not None else None),
+            'isBase64Encoded': False
+        }
+
+    def finish_request(self, event: dict, response: dict, timer: RequestTimer, total: float) -> dict:
+        action = timer.action or event.get('httpMethod', 'POST')
+        self.metrics.observe_request(action, response['statusCode'], timer, total)
+
+        server_timing = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timer.phases.items()]
+        server_timing.append(f'total;dur={total * 1000:.1f}')
+        response['headers'] = {
+            **response.get('headers', {}),
+            'Server-Timing': ', '.join(server_timing),
+            'Timing-Allow-Origin': '*'
+        }
+
+        if REQUEST_LOG:
+            print(json.dumps({
+                'function': self.function_name,
+                'action': action,
+                'status': response['statusCode'],
+                'total_ms': round(total * 1000, 1),
+                'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in timer.phases.items()},
+                'queries': timer.queries,
+                'rows': timer.rows
+            }))
+
+        return response
+
+    @contextlib.contextmanager
+    def request(self):
+        timer = RequestTimer()
+        token = request_timer.set(timer)
+        try:
+            yield timer
+        finally:
+            request_timer.reset(token)
+
+    def instrumented(self, handler_fn):
+        @functools.wraps(handler_fn)
+        def wrapper(event: dict, context) -> dict:
+            started = time.perf_counter()
+            with self.request() as timer:
+                response = handler_fn(event, context)
+            return self.finish_request(event, response, timer, time.perf_counter() - started)
+        return wrapper
+
+class TimingCursorMixin:
+    '''Учитывает время execute в фазе query, число полученных строк и медленные запросы'''
+
+    # Подкласс в функции указывает здесь её объект Instrumentation
+    instrumentation = None
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with phase('query'):
+            result = super().execute(query, vars)
+        duration = time.perf_counter() - started
+        rows = self.rowcount if self.description is not None and self.rowcount > 0 else 0
+        record_query(rows)
+        # У именованного курсора execute лишь объявляет курсор, время выборки учитывает вызывающий код
+        if self.name is None and self.instrumentation is not None:
+            self.instrumentation.record_slow_query(self.connection, query, vars, duration, rows)
+        return result
+
+def sql_isoformat(column: str, pattern: str = 'YYYY-MM-DD"T"HH24:MI:SS') -> str:
+    # Как isoformat() в Python: микросекунды выводятся, только если они не нулевые
+    return (
+        f"CASE WHEN date_part('microseconds', {column})::bigint %% 1000000 = 0 "
+        f"THEN to_char({column}, '{pattern}') "
+        f"ELSE to_char({column}, '{pattern}.US') END"
+    )
+
+def json_default(value):
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(payload) -> str:
+    with phase('serialize'):
+        if orjson is not None:
+            return orjson.dumps(payload, default=json_default).decode('utf-8')
+        # Без orjson тот же компактный вид без \u-экранирования: ответ побайтно совпадает с orjson и LISTING_SQL_JSON
+        return json.dumps(payload, default=json_default, separators=(',', ':'), ensure_ascii=False)
+
+def accepted_encodings(event: dict) -> dict:
+    accepted = {}
+    for part in (get_header(event, 'Accept-Encoding') or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted
+
+def compress_response(event: dict, response: dict) -> dict:
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body:
+        return response
+
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    headers = dict(response.get('headers') or {})
+    headers['Vary'] = 'Accept-Encoding'
+    accepted = accepted_encodings(event)
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        encoding = 'br'
+        with phase('compress'):
+            compressed = brotli.compress(raw, quality=RESPONSE_BROTLI_QUALITY)
+    elif accepted.get('gzip', 0) > 0:
+        encoding = 'gzip'
+        with phase('compress'):
+            compressed = gzip.compress(raw, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+    else:
+        return {**response, 'headers': headers}
+
+    headers['Content-Encoding'] = encoding
+    if headers.get('ETag', '').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
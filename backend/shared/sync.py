@@ -0,0 +1,56 @@
+'''Копирует общие модули backend/shared в папки функций
+
+Каждая функция деплоится отдельной папкой и не видит соседних каталогов, поэтому общий код лежит
+в папке функции копией. Правится только оригинал в backend/shared, копии обновляет этот скрипт.
+
+    python backend/shared/sync.py          — обновить копии
+    python backend/shared/sync.py --check  — код выхода 1, если копия разошлась с оригиналом
+'''
+import argparse
+import os
+import sys
+from typing import Optional
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SHARED_DIR)
+# Модуль и функции, в которые он копируется
+SHARED_MODULES = {
+    'db_pool.py': ('auth', 'events', 'payment'),
+    'runtime.py': ('auth', 'events', 'payment', 'worker'),
+    'session_tokens.py': ('auth', 'events', 'payment'),
+}
+HEADER = '# Копия backend/shared/{name}: правьте оригинал и запускайте python backend/shared/sync.py\n'
+
+def expected_copy(name: str) -> str:
+    with open(os.path.join(SHARED_DIR, name), encoding='utf-8') as f:
+        return HEADER.format(name=name) + f.read()
+
+def read_copy(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def sync(check: bool) -> list:
+    outdated = []
+    for name, functions in SHARED_MODULES.items():
+        content = expected_copy(name)
+        for function in functions:
+            path = os.path.join(BACKEND_DIR, function, name)
+            if read_copy(path) == content:
+                continue
+            outdated.append(os.path.relpath(path, BACKEND_DIR))
+            if not check:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+    return outdated
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Синхронизировать копии общих модулей в папках функций')
+    parser.add_argument('--check', action='store_true', help='Только проверить, ничего не записывая')
+    args = parser.parse_args()
+
+    outdated = sync(args.check)
+    for path in outdated:
+        print(f'{"расходится с оригиналом" if args.check else "обновлено"}: backend/{path}')
+    sys.exit(1 if args.check and outdated else 0)
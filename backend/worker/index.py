@@ -0,0 +1,466 @@
+import json
+import os
+import smtplib
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from runtime import forbidden_response, is_admin_request
+
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '8'))
+EMAIL_RETRY_BASE_SECONDS = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+EMAIL_RETRY_MAX_SECONDS = int(os.environ.get('EMAIL_RETRY_MAX_SECONDS', '3600'))
+HOLD_RELEASE_BATCH_SIZE = int(os.environ.get('HOLD_RELEASE_BATCH_SIZE', '500'))
+SEAT_RECONCILE_BATCH_SIZE = int(os.environ.get('SEAT_RECONCILE_BATCH_SIZE', '500'))
+EVENT_STATS_BATCH_SIZE = int(os.environ.get('EVENT_STATS_BATCH_SIZE', '5000'))
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', '1000'))
+PUBLICATION_PENDING_TTL_HOURS = int(os.environ.get('PUBLICATION_PENDING_TTL_HOURS', '48'))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.environ.get('EMAIL_OUTBOX_RETENTION_DAYS', '14'))
+WORKER_TIME_BUDGET_SECONDS = float(os.environ.get('WORKER_TIME_BUDGET_SECONDS', '25'))
+WORKER_LOOP_INTERVAL_SECONDS = float(os.environ.get('WORKER_LOOP_INTERVAL_SECONDS', '10'))
+
+class SMTPSender:
+    '''Одно SMTP-соединение, переиспользуемое между пакетами и тёплыми вызовами'''
+
+    def __init__(self):
+        self.host = os.environ.get('SMTP_HOST')
+        self.port = int(os.environ.get('SMTP_PORT', '587'))
+        self.user = os.environ.get('SMTP_USER')
+        self.password = os.environ.get('SMTP_PASSWORD')
+        self._server = None
+
+    def configured(self) -> bool:
+        return all([self.host, self.user, self.password])
+
+    def ensure_connected(self) -> None:
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return
+            except smtplib.SMTPException:
+                pass
+            self.close()
+
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        server.starttls()
+        server.login(self.user, self.password)
+        self._server = server
+
+    def send(self, to_email: str, subject: str, body: str) -> None:
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.user
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'html'))
+
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._server = None
+            self.ensure_connected()
+            self._server.send_message(msg)
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+smtp_sender = SMTPSender()
+
+def retry_delay(attempts: int) -> int:
+    return min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+
+def schedule_retry(cur, email_id: int, attempts: int, error: str) -> str:
+    if attempts >= EMAIL_MAX_ATTEMPTS:
+        cur.execute("""
+            UPDATE t_p2283616_event_discovery_app.email_outbox
+            SET status = 'failed', attempts = %s, last_error = %s
+            WHERE id = %s
+        """, (attempts, error, email_id))
+        return 'failed'
+
+    cur.execute("""
+        UPDATE t_p2283616_event_discovery_app.email_outbox
+        SET attempts = %s, last_error = %s, next_attempt_at = NOW() + make_interval(secs => %s)
+        WHERE id = %s
+    """, (attempts, error, retry_delay(attempts), email_id))
+    return 'retried'
+
+def drain_email_outbox(conn, deadline: float) -> dict:
+    result = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    if not smtp_sender.configured():
+        result['skipped'] = 'SMTP настройки не заполнены'
+        return result
+
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        while time.monotonic() < deadline:
+            cur.execute("""
+                SELECT id, to_email, subject, body, attempts
+                FROM t_p2283616_event_discovery_app.email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (EMAIL_BATCH_SIZE,))
+            batch = cur.fetchall()
+
+            if not batch:
+                break
+
+            try:
+                smtp_sender.ensure_connected()
+            except (smtplib.SMTPException, OSError) as e:
+                for email in batch:
+                    result[schedule_retry(cur, email['id'], email['attempts'] + 1, str(e))] += 1
+                conn.commit()
+                break
+
+            for email in batch:
+                try:
+                    smtp_sender.send(email['to_email'], email['subject'], email['body'])
+                except (smtplib.SMTPException, OSError) as e:
+                    result[schedule_retry(cur, email['id'], email['attempts'] + 1, str(e))] += 1
+                    continue
+
+                cur.execute("""
+                    UPDATE t_p2283616_event_discovery_app.email_outbox
+                    SET status = 'sent', attempts = attempts + 1, sent_at = NOW(), last_error = NULL
+                    WHERE id = %s
+                """, (email['id'],))
+                result['sent'] += 1
+
+            conn.commit()
+
+            if len(batch) < EMAIL_BATCH_SIZE:
+                break
+    finally:
+        cur.close()
+
+    return result
+
+def release_expired_holds(conn, deadline: float) -> dict:
+    released = 0
+    cur = conn.cursor()
+
+    try:
+        while time.monotonic() < deadline:
+            cur.execute("""
+                WITH expired AS (
+                    UPDATE t_p2283616_event_discovery_app.registrations
+                    SET payment_status = 'expired'
+                    WHERE id IN (
+                        SELECT id FROM t_p2283616_event_discovery_app.registrations
+                        WHERE payment_status = 'pending' AND hold_expires_at < NOW()
+                        ORDER BY hold_expires_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING event_id
+                ),
+                seats AS (
+                    UPDATE t_p2283616_event_discovery_app.events e
+                    SET seats_taken = GREATEST(e.seats_taken - c.released, 0)
+                    FROM (SELECT event_id, COUNT(*) AS released FROM expired GROUP BY event_id) c
+                    WHERE e.id = c.event_id
+                    RETURNING e.id
+                )
+                SELECT COUNT(*) FROM expired
+            """, (HOLD_RELEASE_BATCH_SIZE,))
+            batch_released = cur.fetchone()[0]
+            conn.commit()
+
+            released += batch_released
+            if batch_released < HOLD_RELEASE_BATCH_SIZE:
+                break
+    finally:
+        cur.close()
+
+    return {'released': released}
+
+# Таблица, ключ, условие устаревания и индексируемый столбец порядка
+SWEEP_TARGETS = (
+    ('sms_codes', 'phone', "expires_at < NOW()", 'expires_at'),
+    ('password_reset_tokens', 'id', "expires_at < NOW()", 'expires_at'),
+    ('event_publications', 'id',
+     "payment_status = 'pending' AND created_at < NOW() - make_interval(hours => %(publication_ttl_hours)s)", 'created_at'),
+    ('email_outbox', 'id',
+     "status = 'sent' AND sent_at < NOW() - make_interval(days => %(outbox_retention_days)s)", 'sent_at'),
+)
+
+def sweep_expired(conn, deadline: float) -> dict:
+    params = {
+        'batch_size': SWEEP_BATCH_SIZE,
+        'publication_ttl_hours': PUBLICATION_PENDING_TTL_HOURS,
+        'outbox_retention_days': EMAIL_OUTBOX_RETENTION_DAYS
+    }
+    result = {}
+    cur = conn.cursor()
+
+    try:
+        for table, key, condition, order_column in SWEEP_TARGETS:
+            result[table] = 0
+            # Короткие транзакции по SWEEP_BATCH_SIZE строк не держат блокировки дольше одной пачки
+            while time.monotonic() < deadline:
+                cur.execute(f"""
+                    DELETE FROM t_p2283616_event_discovery_app.{table}
+                    WHERE {key} IN (
+                        SELECT {key} FROM t_p2283616_event_discovery_app.{table}
+                        WHERE {condition}
+                        ORDER BY {order_column}
+                        LIMIT %(batch_size)s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                """, params)
+                deleted = cur.rowcount
+                conn.commit()
+
+                result[table] += deleted
+                if deleted < SWEEP_BATCH_SIZE:
+                    break
+    finally:
+        cur.close()
+
+    return result
+
+def rebuild_event_stats(conn, deadline: float) -> dict:
+    checked = drifted = corrected = 0
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT LEAST((SELECT MIN(event_id) FROM t_p2283616_event_discovery_app.registrations),
+                         (SELECT MIN(event_id) FROM t_p2283616_event_discovery_app.event_stats))
+        """)
+        next_event_id = cur.fetchone()[0]
+        conn.commit()
+
+        # Сводка сверяется диапазонами event_id без блокировки таблицы: расхождения ищутся обычным чтением,
+        # а исправляются только у найденных мероприятий. Пустые промежутки между id пропускаются по индексам
+        while next_event_id is not None:
+            if time.monotonic() >= deadline:
+                break
+            range_end = next_event_id + EVENT_STATS_BATCH_SIZE
+            cur.execute("""
+                WITH actual AS (
+                    SELECT event_id,
+                           COUNT(*) AS registrations_count,
+                           COUNT(*) FILTER (WHERE payment_status = 'paid') AS paid_count,
+                           COALESCE(SUM(payment_amount) FILTER (WHERE payment_status = 'paid'), 0) AS revenue
+                    FROM t_p2283616_event_discovery_app.registrations
+                    WHERE event_id >= %(start)s AND event_id < %(end)s AND payment_status IN ('pending', 'paid')
+                    GROUP BY event_id
+                ),
+                stats AS (
+                    SELECT * FROM t_p2283616_event_discovery_app.event_stats
+                    WHERE event_id >= %(start)s AND event_id < %(end)s
+                ),
+                drift AS (
+                    SELECT COALESCE(a.event_id, s.event_id) AS event_id
+                    FROM actual a
+                    FULL JOIN stats s ON s.event_id = a.event_id
+                    WHERE (a.registrations_count, a.paid_count, a.revenue)
+                          IS DISTINCT FROM (s.registrations_count, s.paid_count, s.revenue)
+                      AND NOT (a.event_id IS NULL AND s.registrations_count = 0 AND s.paid_count = 0 AND s.revenue = 0)
+                )
+                SELECT (SELECT COUNT(*) FROM actual),
+                       (SELECT COALESCE(array_agg(event_id ORDER BY event_id), '{}') FROM drift),
+                       LEAST((SELECT MIN(event_id) FROM t_p2283616_event_discovery_app.registrations WHERE event_id >= %(end)s),
+                             (SELECT MIN(event_id) FROM t_p2283616_event_discovery_app.event_stats WHERE event_id >= %(end)s))
+            """, {'start': next_event_id, 'end': range_end})
+            events, batch, next_event_id = cur.fetchone()
+            conn.commit()
+            checked += events
+
+            if not batch:
+                continue
+            drifted += len(batch)
+            # Триггер меняет строку сводки в транзакции самой регистрации. Пока строки пачки заблокированы, он ждёт,
+            # поэтому пересчёт отдельным запросом видит все зафиксированные регистрации, а незафиксированные
+            # добавят свою разницу уже к исправленным значениям. Недостающие строки создаются заранее,
+            # чтобы блокировать было что
+            cur.execute("""
+                INSERT INTO t_p2283616_event_discovery_app.event_stats (event_id)
+                SELECT unnest(%s::int[])
+                ON CONFLICT (event_id) DO NOTHING
+            """, (batch,))
+            cur.execute("""
+                SELECT event_id FROM t_p2283616_event_discovery_app.event_stats
+                WHERE event_id = ANY(%s)
+                ORDER BY event_id
+                FOR UPDATE
+            """, (batch,))
+            cur.execute("""
+                UPDATE t_p2283616_event_discovery_app.event_stats s
+                SET registrations_count = actual.registrations_count,
+                    paid_count = actual.paid_count,
+                    revenue = actual.revenue,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT ids.event_id,
+                           COUNT(r.id) AS registrations_count,
+                           COUNT(r.id) FILTER (WHERE r.payment_status = 'paid') AS paid_count,
+                           COALESCE(SUM(r.payment_amount) FILTER (WHERE r.payment_status = 'paid'), 0) AS revenue
+                    FROM unnest(%s::int[]) AS ids(event_id)
+                    LEFT JOIN t_p2283616_event_discovery_app.registrations r
+                           ON r.event_id = ids.event_id AND r.payment_status IN ('pending', 'paid')
+                    GROUP BY ids.event_id
+                ) actual
+                WHERE s.event_id = actual.event_id
+                  AND (s.registrations_count, s.paid_count, s.revenue)
+                      IS DISTINCT FROM (actual.registrations_count, actual.paid_count, actual.revenue)
+            """, (batch,))
+            corrected += cur.rowcount
+            conn.commit()
+    finally:
+        cur.close()
+
+    result = {'events': checked, 'drifted': drifted, 'corrected': corrected}
+    if next_event_id is not None:
+        # Бюджет кончился раньше конца диапазона; следующий запуск начнёт сверку заново
+        result['stopped_at_event_id'] = next_event_id
+    return result
+
+def reconcile_seats_taken(conn, deadline: float) -> dict:
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT e.id
+            FROM t_p2283616_event_discovery_app.events e
+            LEFT JOIN (
+                SELECT event_id, COUNT(*) AS taken
+                FROM t_p2283616_event_discovery_app.registrations
+                WHERE payment_status IN ('pending', 'paid')
+                GROUP BY event_id
+            ) r ON r.event_id = e.id
+            WHERE e.seats_taken <> COALESCE(r.taken, 0)
+            ORDER BY e.id
+        """)
+        drifted = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        corrected = 0
+        for start in range(0, len(drifted), SEAT_RECONCILE_BATCH_SIZE):
+            if time.monotonic() >= deadline:
+                break
+            batch = drifted[start:start + SEAT_RECONCILE_BATCH_SIZE]
+            # Сначала блокируются строки мероприятий: create_payment и вебхук меняют счётчик под той же блокировкой,
+            # поэтому пересчёт отдельным запросом видит все брони, зафиксированные до неё
+            cur.execute("""
+                SELECT id FROM t_p2283616_event_discovery_app.events
+                WHERE id = ANY(%s)
+                ORDER BY id
+                FOR UPDATE
+            """, (batch,))
+            cur.execute("""
+                UPDATE t_p2283616_event_discovery_app.events e
+                SET seats_taken = actual.taken
+                FROM (
+                    SELECT e2.id,
+                           (SELECT COUNT(*) FROM t_p2283616_event_discovery_app.registrations r
+                            WHERE r.event_id = e2.id AND r.payment_status IN ('pending', 'paid')) AS taken
+                    FROM t_p2283616_event_discovery_app.events e2
+                    WHERE e2.id = ANY(%s)
+                ) actual
+                WHERE e.id = actual.id AND e.seats_taken <> actual.taken
+            """, (batch,))
+            corrected += cur.rowcount
+            conn.commit()
+    finally:
+        cur.close()
+
+    return {'drifted': len(drifted), 'corrected': corrected}
+
+TASKS = {
+    'drain_email_outbox': drain_email_outbox,
+    'release_expired_holds': release_expired_holds,
+    'sweep_expired': sweep_expired,
+    'rebuild_event_stats': rebuild_event_stats,
+    'reconcile_seats_taken': reconcile_seats_taken
+}
+# Пересборка сводки и сверка счётчика мест запускаются вручную, по расписанию идут только остальные задачи
+SCHEDULED_TASKS = ('drain_email_outbox', 'release_expired_holds', 'sweep_expired')
+
+def run_tasks(task_names: list) -> dict:
+    deadline = time.monotonic() + WORKER_TIME_BUDGET_SECONDS
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+
+    try:
+        results = {}
+        for name in task_names:
+            started = time.monotonic()
+            results[name] = TASKS[name](conn, deadline)
+            results[name]['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return results
+    finally:
+        conn.close()
+
+def parse_task_names(event: dict) -> tuple:
+    # Без тела и без tasks запускаются задачи по расписанию
+    if event.get('httpMethod') != 'POST':
+        return list(SCHEDULED_TASKS), None
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        return None, 'Тело запроса должно быть JSON'
+    if not isinstance(body, dict):
+        return None, 'Тело запроса должно быть JSON-объектом'
+
+    task_names = body.get('tasks')
+    if task_names is None or task_names == []:
+        return list(SCHEDULED_TASKS), None
+    if not isinstance(task_names, list) or not all(isinstance(name, str) for name in task_names):
+        return None, 'tasks должен быть списком имён задач'
+
+    unknown = [name for name in task_names if name not in TASKS]
+    if unknown:
+        return None, f'Неизвестные задачи: {", ".join(unknown)}'
+    return task_names, None
+
+def handler(event: dict, context) -> dict:
+    '''Фоновые задачи по расписанию: отправка писем из очереди, снятие просроченных броней, очистка устаревших данных'''
+    # Триггер по расписанию и цикл __main__ вызывают handler без HTTP; запуск по HTTP — только с ADMIN_TOKEN
+    if event.get('httpMethod') and not is_admin_request(event):
+        return forbidden_response()
+
+    task_names, error = parse_task_names(event)
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': error}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        results = run_tasks(task_names)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    print(json.dumps({'worker': results}))
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'results': results}),
+        'isBase64Encoded': False
+    }
+
+if __name__ == '__main__':
+    while True:
+        handler({}, None)
+        time.sleep(WORKER_LOOP_INTERVAL_SECONDS)
@@ -0,0 +1,11 @@
+-- Ячейка сетки 0.1° x 0.1° для поиска мероприятий рядом с точкой
+ALTER TABLE t_p2283616_event_discovery_app.events
+ADD COLUMN IF NOT EXISTS geo_cell INTEGER GENERATED ALWAYS AS (
+    LEAST(FLOOR((latitude + 90) * 10), 1800)::INTEGER * 3600
+    + LEAST(FLOOR((longitude + 180) * 10), 3599)::INTEGER
+) STORED;
+
+-- B-tree по ячейке: запрос перебирает диапазоны ячеек по строкам сетки
+CREATE INDEX IF NOT EXISTS idx_events_published_geo_cell
+ON t_p2283616_event_discovery_app.events(geo_cell)
+WHERE status = 'published';
@@ -0,0 +1,9 @@
+-- Полнотекстовый поиск по названию и описанию мероприятий (русская морфология)
+ALTER TABLE t_p2283616_event_discovery_app.events
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', COALESCE(title, '')), 'A')
+    || setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_events_search_vector
+ON t_p2283616_event_discovery_app.events USING GIN (search_vector);
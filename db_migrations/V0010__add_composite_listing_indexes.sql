@@ -0,0 +1,30 @@
+-- Частичные составные индексы под ленту опубликованных мероприятий:
+-- фильтр по статусу, городу и категории и сортировка по (event_date, id) без отдельного Sort
+CREATE INDEX IF NOT EXISTS idx_events_published_date
+ON t_p2283616_event_discovery_app.events(event_date, id)
+WHERE status = 'published';
+
+CREATE INDEX IF NOT EXISTS idx_events_published_city_date
+ON t_p2283616_event_discovery_app.events(city, event_date, id)
+WHERE status = 'published';
+
+CREATE INDEX IF NOT EXISTS idx_events_published_category_date
+ON t_p2283616_event_discovery_app.events(category, event_date, id)
+WHERE status = 'published';
+
+CREATE INDEX IF NOT EXISTS idx_events_published_city_category_date
+ON t_p2283616_event_discovery_app.events(city, category, event_date, id)
+WHERE status = 'published';
+
+-- Лента организатора показывает все статусы в том же порядке
+CREATE INDEX IF NOT EXISTS idx_events_organizer_date
+ON t_p2283616_event_discovery_app.events(organizer_id, event_date, id);
+
+-- Регистрации пользователя, новые сверху (get_user_registrations)
+CREATE INDEX IF NOT EXISTS idx_registrations_user_created
+ON t_p2283616_event_discovery_app.registrations(user_id, created_at DESC);
+
+-- Одноколоночные индексы, которые теперь покрываются составными
+DROP INDEX IF EXISTS t_p2283616_event_discovery_app.idx_events_status;
+DROP INDEX IF EXISTS t_p2283616_event_discovery_app.idx_events_organizer_id;
+DROP INDEX IF EXISTS t_p2283616_event_discovery_app.idx_registrations_user_id;
@@ -0,0 +1,18 @@
+-- Очередь исходящих писем: обработчик только ставит письмо в очередь, отправляет воркер
+CREATE TABLE IF NOT EXISTS t_p2283616_event_discovery_app.email_outbox (
+    id SERIAL PRIMARY KEY,
+    to_email VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Воркер выбирает готовые к отправке письма по времени следующей попытки
+CREATE INDEX IF NOT EXISTS idx_email_outbox_pending
+ON t_p2283616_event_discovery_app.email_outbox(next_attempt_at)
+WHERE status = 'pending';
@@ -0,0 +1,25 @@
+-- Учёт занятых мест: бронь (pending) держит место до hold_expires_at, оплата закрепляет его
+ALTER TABLE t_p2283616_event_discovery_app.events
+ADD COLUMN IF NOT EXISTS seats_taken INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p2283616_event_discovery_app.registrations
+ADD COLUMN IF NOT EXISTS hold_expires_at TIMESTAMP;
+
+UPDATE t_p2283616_event_discovery_app.registrations
+SET hold_expires_at = CURRENT_TIMESTAMP + INTERVAL '15 minutes'
+WHERE payment_status = 'pending' AND hold_expires_at IS NULL;
+
+UPDATE t_p2283616_event_discovery_app.events e
+SET seats_taken = r.taken
+FROM (
+    SELECT event_id, COUNT(*) AS taken
+    FROM t_p2283616_event_discovery_app.registrations
+    WHERE payment_status IN ('pending', 'paid')
+    GROUP BY event_id
+) r
+WHERE e.id = r.event_id;
+
+-- Воркер снимает просроченные брони по времени истечения
+CREATE INDEX IF NOT EXISTS idx_registrations_pending_hold
+ON t_p2283616_event_discovery_app.registrations(hold_expires_at)
+WHERE payment_status = 'pending';
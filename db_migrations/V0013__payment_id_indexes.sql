@@ -0,0 +1,6 @@
+-- Вебхук СБП находит регистрацию и публикацию по идентификатору платежа
+CREATE INDEX IF NOT EXISTS idx_registrations_payment_id
+ON t_p2283616_event_discovery_app.registrations(payment_id);
+
+CREATE INDEX IF NOT EXISTS idx_event_publications_payment_id
+ON t_p2283616_event_discovery_app.event_publications(payment_id);
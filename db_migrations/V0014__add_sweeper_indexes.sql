@@ -0,0 +1,14 @@
+-- Очистка просроченных данных удаляет строки пачками по индексам времени
+CREATE INDEX IF NOT EXISTS idx_sms_codes_expires
+ON t_p2283616_event_discovery_app.sms_codes(expires_at);
+
+CREATE INDEX IF NOT EXISTS idx_event_publications_pending_created
+ON t_p2283616_event_discovery_app.event_publications(created_at)
+WHERE payment_status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_sent
+ON t_p2283616_event_discovery_app.email_outbox(sent_at)
+WHERE status = 'sent';
+
+-- Первичный ключ уже индексирует phone, отдельный индекс только замедляет запись
+DROP INDEX IF EXISTS t_p2283616_event_discovery_app.idx_sms_codes_phone;
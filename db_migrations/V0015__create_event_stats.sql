@@ -0,0 +1,70 @@
+-- Сводка по мероприятию для кабинета организатора, поддерживается триггером на registrations
+CREATE TABLE IF NOT EXISTS t_p2283616_event_discovery_app.event_stats (
+    event_id INTEGER PRIMARY KEY,
+    registrations_count INTEGER NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0,
+    revenue BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Регистрация учитывается, пока бронь активна или оплачена; выручка — сумма оплаченных
+CREATE OR REPLACE FUNCTION t_p2283616_event_discovery_app.apply_event_stats_delta(
+    p_event_id INTEGER, p_status VARCHAR, p_amount INTEGER, p_sign INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    IF p_status NOT IN ('pending', 'paid') THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO t_p2283616_event_discovery_app.event_stats AS s (event_id, registrations_count, paid_count, revenue)
+    VALUES (
+        p_event_id,
+        p_sign,
+        CASE WHEN p_status = 'paid' THEN p_sign ELSE 0 END,
+        CASE WHEN p_status = 'paid' THEN p_sign * COALESCE(p_amount, 0) ELSE 0 END
+    )
+    ON CONFLICT (event_id) DO UPDATE
+    SET registrations_count = s.registrations_count + EXCLUDED.registrations_count,
+        paid_count = s.paid_count + EXCLUDED.paid_count,
+        revenue = s.revenue + EXCLUDED.revenue,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p2283616_event_discovery_app.registrations_event_stats_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM t_p2283616_event_discovery_app.apply_event_stats_delta(OLD.event_id, OLD.payment_status, OLD.payment_amount, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM t_p2283616_event_discovery_app.apply_event_stats_delta(NEW.event_id, NEW.payment_status, NEW.payment_amount, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_registrations_event_stats_insert_delete ON t_p2283616_event_discovery_app.registrations;
+CREATE TRIGGER trg_registrations_event_stats_insert_delete
+AFTER INSERT OR DELETE ON t_p2283616_event_discovery_app.registrations
+FOR EACH ROW EXECUTE FUNCTION t_p2283616_event_discovery_app.registrations_event_stats_trigger();
+
+-- Продление брони и смена payment_url не меняют сводку, поэтому триггер срабатывает только на значимые поля
+DROP TRIGGER IF EXISTS trg_registrations_event_stats_update ON t_p2283616_event_discovery_app.registrations;
+CREATE TRIGGER trg_registrations_event_stats_update
+AFTER UPDATE ON t_p2283616_event_discovery_app.registrations
+FOR EACH ROW
+WHEN (OLD.payment_status IS DISTINCT FROM NEW.payment_status
+      OR OLD.event_id IS DISTINCT FROM NEW.event_id
+      OR OLD.payment_amount IS DISTINCT FROM NEW.payment_amount)
+EXECUTE FUNCTION t_p2283616_event_discovery_app.registrations_event_stats_trigger();
+
+INSERT INTO t_p2283616_event_discovery_app.event_stats (event_id, registrations_count, paid_count, revenue)
+SELECT event_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE payment_status = 'paid'),
+       COALESCE(SUM(payment_amount) FILTER (WHERE payment_status = 'paid'), 0)
+FROM t_p2283616_event_discovery_app.registrations
+WHERE payment_status IN ('pending', 'paid')
+GROUP BY event_id
+ON CONFLICT (event_id) DO NOTHING;
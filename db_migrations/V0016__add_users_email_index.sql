@@ -0,0 +1,3 @@
+-- Вход по email искал пользователя последовательным просмотром users
+CREATE INDEX IF NOT EXISTS idx_users_email
+ON t_p2283616_event_discovery_app.users(email);
@@ -0,0 +1,38 @@
+-- Версия ленты мероприятий: растёт в той же транзакции, что и изменение видимых в ленте полей.
+-- events строит ETag из неё и параметров запроса и отвечает 304, не выполняя запрос ленты
+CREATE TABLE IF NOT EXISTS t_p2283616_event_discovery_app.listing_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p2283616_event_discovery_app.listing_version (id) VALUES (TRUE)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p2283616_event_discovery_app.bump_listing_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p2283616_event_discovery_app.listing_version
+    SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры на оператор: пакет create_events_bulk меняет версию один раз
+DROP TRIGGER IF EXISTS trg_events_listing_version_insert_delete ON t_p2283616_event_discovery_app.events;
+CREATE TRIGGER trg_events_listing_version_insert_delete
+AFTER INSERT OR DELETE ON t_p2283616_event_discovery_app.events
+FOR EACH STATEMENT EXECUTE FUNCTION t_p2283616_event_discovery_app.bump_listing_version();
+
+DROP TRIGGER IF EXISTS trg_events_listing_version_truncate ON t_p2283616_event_discovery_app.events;
+CREATE TRIGGER trg_events_listing_version_truncate
+AFTER TRUNCATE ON t_p2283616_event_discovery_app.events
+FOR EACH STATEMENT EXECUTE FUNCTION t_p2283616_event_discovery_app.bump_listing_version();
+
+-- seats_taken меняется при каждой брони и в ленте не показывается, поэтому UPDATE учитывается только по видимым полям
+DROP TRIGGER IF EXISTS trg_events_listing_version_update ON t_p2283616_event_discovery_app.events;
+CREATE TRIGGER trg_events_listing_version_update
+AFTER UPDATE OF organizer_id, title, description, category, city, event_date, event_time,
+                participant_price, latitude, longitude, max_participants, status, created_at
+ON t_p2283616_event_discovery_app.events
+FOR EACH STATEMENT EXECUTE FUNCTION t_p2283616_event_discovery_app.bump_listing_version();
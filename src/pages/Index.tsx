@@ -132,10 +132,18 @@ const Index = () => {
   const [selectedEventForPayment, setSelectedEventForPayment] = useState<any>(null);
   const [createEventModalOpen, setCreateEventModalOpen] = useState(false);
   const [dbEvents, setDbEvents] = useState<any[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showQR, setShowQR] = useState(false);
   const [deferredPrompt, setDeferredPrompt] = useState<any>(null);
 
   useEffect(() => {
+    // Токены старого формата сервер больше не принимает: такой пользователь входит заново
+    const storedToken = localStorage.getItem('auth_token');
+    if (storedToken && !storedToken.startsWith('v1.')) {
+      localStorage.removeItem('auth_token');
+      localStorage.removeItem('user');
+    }
     const storedUser = localStorage.getItem('user');
     if (storedUser) {
       setUser(JSON.parse(storedUser));
@@ -164,15 +172,25 @@ const Index = () => {
     };
   }, []);
 
-  const loadEvents = async () => {
+  const loadEvents = async (cursor: string | null = null) => {
     try {
-      const response = await fetch(API_URLS.events);
+      // Лента отдаётся страницами: первая при открытии, следующие по кнопке «Показать ещё»
+      const params = new URLSearchParams({ limit: '50' });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
+      setLoadingMore(true);
+      const response = await fetch(`${API_URLS.events}?${params}`);
       const data = await response.json();
-      if (response.ok) {
-        setDbEvents(data.events);
+      if (!response.ok) {
+        return;
       }
+      setDbEvents((prev) => (cursor ? [...prev, ...data.events] : data.events));
+      setNextCursor(data.next_cursor);
     } catch (err) {
       console.error('Ошибка загрузки мероприятий:', err);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -565,6 +583,13 @@ const Index = () => {
                 })}
               </div>
             )}
+            {nextCursor && (
+              <div className="flex justify-center">
+                <Button variant="outline" onClick={() => loadEvents(nextCursor)} disabled={loadingMore}>
+                  {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                </Button>
+              </div>
+            )}
           </TabsContent>
 
           <TabsContent value="map" className="mt-6">